@@ -0,0 +1,349 @@
+# Rough benchmarks for the gofish library, to keep an eye on speed and memory.
+#
+#   python benchmark.py                 # run everything
+#   python benchmark.py memory          # run just the named benchmark(s)
+
+import copy, gc, random, sys, time, tracemalloc
+
+import gofish
+from gofish import BLACK, WHITE
+
+# --------------------------------------------------------------------------------------
+
+def synthetic_tree(count, seed = 0, weak_parents = False):     # A random tree of moves, a bit like a joseki dictionary
+
+    rng = random.Random(seed)
+
+    root = gofish.new_tree(19, weak_parents = weak_parents)
+    node = root
+    made = 1
+
+    while made < count:
+        if rng.random() < 0.05:                 # Jump back to some earlier point to start a variation
+            for n in range(rng.randint(1, 20)):
+                if node.parent:
+                    node = node.parent
+        colour = WHITE if node.moves_made % 2 else BLACK
+        child = gofish.Node(parent = node)
+        child.set_value("B" if colour == BLACK else "W", gofish.string_from_point(rng.randint(1, 19), rng.randint(1, 19)))
+        child.moves_made = node.moves_made + 1
+        node = child
+        made += 1
+
+    return root
+
+# --------------------------------------------------------------------------------------
+
+def bench_memory():
+
+    count = 200000
+
+    tracemalloc.start()
+    root = synthetic_tree(count)
+    used, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("memory: {} nodes use {:.1f} MB, {:.0f} bytes per node".format(count, used / 1e6, used / count))
+
+    tracemalloc.start()
+    boards = [gofish.Board(19) for n in range(1000)]
+    used, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("memory: 19x19 boards use {:.0f} bytes each".format(used / len(boards)))
+
+# --------------------------------------------------------------------------------------
+
+def bench_store():
+
+    count = 200000
+    root = synthetic_tree(count)
+
+    tracemalloc.start()
+    store = gofish.TreeStore()
+    store.add_tree(root)
+    used, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("store: {} nodes use {:.1f} MB, {:.0f} bytes per node".format(len(store), used / 1e6, used / len(store)))
+
+    # Count the moves in the whole tree, first with Nodes, then with the store's columns...
+
+    start = time.perf_counter()
+    moves = 0
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if "B" in node.properties or "W" in node.properties:
+            moves += 1
+        stack += node.children
+    print("store: full traversal of Nodes took {:.3f} s ({} moves)".format(time.perf_counter() - start, moves))
+
+    start = time.perf_counter()
+    moves = 0
+    for index in store.walk():
+        if store.moves[index]:
+            moves += 1
+    print("store: full traversal of TreeStore took {:.3f} s ({} moves)".format(time.perf_counter() - start, moves))
+
+# --------------------------------------------------------------------------------------
+
+def bench_browse():                         # Look at the boards of lots of nodes, as someone browsing a tree might
+
+    root = synthetic_tree(20000)
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack += node.children
+
+    gofish.board_cache.clear()
+    gofish.board_cache.reset_stats()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for node in nodes[:5000]:
+        node.board
+    elapsed = time.perf_counter() - start
+    used, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("browse: 5000 boards took {:.3f} s, {:.1f} MB still held".format(elapsed, used / 1e6))
+    print("browse: cache stats {}".format(gofish.board_cache.stats()))
+
+# --------------------------------------------------------------------------------------
+
+def bench_jump():                           # Random access to the boards of a long game
+
+    rng = random.Random(0)
+
+    root = gofish.new_tree(19)
+    node = root
+    for n in range(300):
+        node = gofish.Node(parent = node)
+        node.set_value("B" if n % 2 == 0 else "W", gofish.string_from_point(rng.randint(1, 19), rng.randint(1, 19)))
+    nodes = node.node_path()
+
+    for interval in [0, 16]:
+
+        gofish.board_cache.clear()
+        gofish.board_cache.checkpoint_interval = interval
+        gofish.board_cache.resize(0)        # So every lookup is a jump, as if the cache had been churned
+
+        worst = 0
+        start = time.perf_counter()
+        for n in range(500):
+            t = time.perf_counter()
+            rng.choice(nodes).board
+            worst = max(worst, time.perf_counter() - t)
+        elapsed = time.perf_counter() - start
+
+        print("jump: checkpoint interval {:2}: {:.2f} ms per lookup, worst {:.2f} ms, {} checkpoints".format(
+            interval, elapsed / 500 * 1000, worst * 1000, gofish.board_cache.stats()["checkpoints"]))
+
+    gofish.board_cache.checkpoint_interval = 16
+    gofish.board_cache.resize(1024)
+
+# --------------------------------------------------------------------------------------
+
+def random_game(moves, seed = 0, superko = None):       # Play a game of random legal moves with make_move(), return the end node
+
+    rng = random.Random(seed)
+
+    node = gofish.new_tree(19)
+    made = 0
+
+    while made < moves:
+        try:
+            node = node.make_move(rng.randint(1, 19), rng.randint(1, 19), superko = superko)
+            made += 1
+        except gofish.IllegalMove:
+            pass
+
+    return node
+
+
+def bench_copy():
+
+    board = random_game(150).board
+
+    count = 5000
+
+    start = time.perf_counter()
+    for n in range(count):
+        copy.deepcopy(board)
+    print("copy: copy.deepcopy(board) takes {:.1f} us".format((time.perf_counter() - start) / count * 1e6))
+
+    if hasattr(board, "copy"):
+        start = time.perf_counter()
+        for n in range(count):
+            board.copy()
+        print("copy: board.copy() takes {:.1f} us".format((time.perf_counter() - start) / count * 1e6))
+
+    start = time.perf_counter()
+    for seed in range(10):
+        random_game(200, seed)
+    print("copy: make_move() takes {:.1f} us per move".format((time.perf_counter() - start) / 2000 * 1e6))
+
+    start = time.perf_counter()
+    for seed in range(10):
+        random_game(200, seed, superko = "positional")
+    print("copy: make_move() with superko takes {:.1f} us per move".format((time.perf_counter() - start) / 2000 * 1e6))
+
+# --------------------------------------------------------------------------------------
+
+def bench_walk():                           # Visit the position at every node of a tree
+
+    root = synthetic_tree(20000)
+
+    gofish.board_cache.clear()
+    start = time.perf_counter()
+    stack = [root]                          # Asking each node for its board, as the editor does
+    while stack:
+        node = stack.pop()
+        node.board
+        stack += reversed(node.children)
+    print("walk: node.board for each node took {:.3f} s".format(time.perf_counter() - start))
+
+    gofish.board_cache.clear()
+    start = time.perf_counter()
+    stack = [(root, root.board)]            # Copying the board from each node to its children
+    while stack:
+        node, board = stack.pop()
+        for child in node.children:
+            child_board = board.copy()
+            child_board.update_from_node(child)
+            stack.append((child, child_board))
+    print("walk: copying boards took {:.3f} s".format(time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for node, board in gofish.walk_boards(root):
+        pass
+    print("walk: walk_boards() took {:.3f} s".format(time.perf_counter() - start))
+
+# --------------------------------------------------------------------------------------
+
+def bench_replay():                         # Replay the main lines of many games onto fresh boards, as for a database
+
+    games = [random_game(250, seed).node_path() for seed in range(20)]
+    moves = sum(len(path) - 1 for path in games)
+    plays = [[(node.move_colour(), *node.move_coords()) for node in path[1:]] for path in games]
+
+    for board_class in [gofish.Board, gofish.BitBoard]:
+
+        start = time.perf_counter()
+        for path in games:
+            board = board_class(19)
+            for node in path:
+                board.update_from_node(node)
+        elapsed = time.perf_counter() - start
+        print("replay: {:8} update_from_node() {:.0f} moves per second".format(board_class.__name__, moves / elapsed))
+
+        start = time.perf_counter()
+        for game in plays:
+            board = board_class(19)
+            for colour, x, y in game:
+                board.play_move(colour, x, y)
+        elapsed = time.perf_counter() - start
+        print("replay: {:8} play_move()        {:.0f} moves per second".format(board_class.__name__, moves / elapsed))
+
+# --------------------------------------------------------------------------------------
+
+def bench_legal():                          # Find all the legal moves, by trying every point or with legal_moves()
+
+    nodes = [random_game(150, seed) for seed in range(5)]
+
+    start = time.perf_counter()
+    for node in nodes:
+        legal = set()
+        for x in range(1, 20):
+            for y in range(1, 20):
+                try:
+                    child = node.make_move(x, y)
+                    legal.add((x, y))
+                    node.remove_child(child)
+                except gofish.IllegalMove:
+                    pass
+    print("legal: make_move() on every point takes {:.2f} ms".format((time.perf_counter() - start) / len(nodes) * 1000))
+
+    start = time.perf_counter()
+    for node in nodes:
+        node.legal_moves()
+    print("legal: legal_moves() takes {:.2f} ms".format((time.perf_counter() - start) / len(nodes) * 1000))
+
+# --------------------------------------------------------------------------------------
+
+def bench_variations():                     # Find moves among many children, as when building an opening tree from games
+
+    rng = random.Random(0)
+
+    root = gofish.new_tree(19)
+    for x in range(1, 20):
+        for y in range(1, 20):
+            root.make_move(x, y)
+
+    count = 20000
+    points = [(rng.randint(1, 19), rng.randint(1, 19)) for n in range(count)]
+
+    start = time.perf_counter()
+    for x, y in points:
+        root.make_move(x, y)
+    print("variations: make_move() to an existing child of 361 takes {:.1f} us".format((time.perf_counter() - start) / count * 1e6))
+
+    start = time.perf_counter()
+    for x, y in points:
+        root.child_for_move(x, y, BLACK)
+    print("variations: child_for_move() takes {:.2f} us".format((time.perf_counter() - start) / count * 1e6))
+
+# --------------------------------------------------------------------------------------
+
+def bench_gc():                             # Getting rid of a big tree, with parent links strong (the default) or weak
+
+    count = 200000
+
+    for weak in [False, True]:
+
+        root = synthetic_tree(count, weak_parents = weak)
+        gc.collect()
+        gc.disable()                        # So nothing is collected except when we say
+
+        start = time.perf_counter()
+        gc.collect()
+        pause = time.perf_counter() - start
+
+        before = len(gc.get_objects())
+        start = time.perf_counter()
+        del root
+        dropping = time.perf_counter() - start
+        left = before - len(gc.get_objects())
+
+        start = time.perf_counter()
+        gc.collect()
+        collecting = time.perf_counter() - start
+
+        gc.enable()
+
+        print("gc: {} parents: full collection with the tree alive takes {:.3f} s".format("weak  " if weak else "strong", pause))
+        print("gc: {} parents: dropping the root frees {} objects in {:.3f} s, the collection after takes {:.3f} s".format(
+            "weak  " if weak else "strong", left, dropping, collecting))
+
+# --------------------------------------------------------------------------------------
+
+benchmarks = {
+    "memory": bench_memory,
+    "store": bench_store,
+    "browse": bench_browse,
+    "jump": bench_jump,
+    "copy": bench_copy,
+    "walk": bench_walk,
+    "replay": bench_replay,
+    "legal": bench_legal,
+    "variations": bench_variations,
+    "gc": bench_gc,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        benchmarks[name]()
@@ -94,7 +94,7 @@ def title_bar_string(node):
         title += " (pass)"
     elif wwtm:
         x, y = wwtm
-        title += " ({})".format(gofish.english_string_from_point(x, y, node.board.boardsize))
+        title += " ({})".format(gofish.english_string_from_point(x, y, node.boardsize()))
     return title
 
 # --------------------------------------------------------------------------------------
@@ -105,7 +105,8 @@ class SGF_Board(tkinter.Canvas):
 
         self.owner = owner
 
-        self.node = gofish.new_tree(19)     # Do this now in case the load fails
+        self.node = gofish.new_tree(19, weak_parents = True)    # Do this now in case the load fails
+        self.root = self.node               # Nodes hold their parents weakly, so we must hold the root
 
         self.directory = os.path.dirname(os.path.realpath(sys.argv[0]))
 
@@ -138,9 +139,8 @@ class SGF_Board(tkinter.Canvas):
 
     def open_file(self, infilename):        # expects that there is already a valid self.node
         try:
-            unlink_target = self.node.get_root_node()
-            self.node = gofish.load(infilename)
-            unlink_target.unlink_recursive()        # remove the old tree's circular references, so GC can work
+            self.node = gofish.load(infilename, lazy = True, weak_parents = True)      # variations are parsed as they are visited
+            self.root = self.node           # the old tree is freed as soon as nothing holds its root
             try:
                 print("<--- Loaded: {}".format(infilename))
             except:
@@ -347,18 +347,16 @@ class SGF_Board(tkinter.Canvas):
         else:
             ok = True
         if ok:
-            unlink_target = self.node
-
             if self.node.parent:
                 parent = self.node.parent
-                parent.children.remove(self.node)
+                parent.remove_child(self.node)      # the deleted nodes are freed once nothing else holds them
                 self.node = parent
                 self.node.fix_main_line_status_recursive()
             else:
-                self.node = gofish.new_tree(self.node.board.boardsize)
+                self.node = gofish.new_tree(self.node.board.boardsize, weak_parents = True)
+                self.root = self.node
 
             self.node_changed()
-            unlink_target.unlink_recursive()      # the old node gets its circular references recursively removed to allow GC to work
 
     def handle_key_P(self):
         self.node = self.node.make_pass()
@@ -427,9 +425,8 @@ class SGF_Board(tkinter.Canvas):
         self.node_changed()
 
     def new_board(self, size):      # assumes there already is a board; will crash if this is not so
-        unlink_target = self.node.get_root_node()
-        self.node = gofish.new_tree(size)
-        unlink_target.unlink_recursive()    # recursively destroy the old tree's circular references so the GC can work
+        self.node = gofish.new_tree(size, weak_parents = True)
+        self.root = self.node
         self.node_changed()
 
     def set_handicap(self, h):
@@ -455,8 +452,7 @@ class SGF_Board(tkinter.Canvas):
 
     def clear_markup_all(self):
         commentwindow.text_widget.delete(1.0, tkinter.END)  # Clear the comment window so it doesn't rewrite its text
-        root = self.node.get_root_node()
-        root.clear_markup_recursive()
+        self.root.clear_markup_recursive()
         self.node_changed()
 
 # ---------------------------------------------------------------------------------------
@@ -5,3 +5,7 @@ from gofish.loader import *
 from gofish.gib import *
 from gofish.ngf import *
 from gofish.sgf import *
+from gofish.batch import *
+from gofish.bitboard import *
+from gofish.features import *
+from gofish.store import *
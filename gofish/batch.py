@@ -0,0 +1,116 @@
+# Loading lots of files at once, using a pool of worker processes.
+
+import functools
+import multiprocessing
+
+from gofish.constants import *
+from gofish.loader import *
+from gofish.tree import *
+
+def load_many(filenames, workers = None, chunksize = 8, summary = False):
+
+    # Yields (filename, result, error) for each file, in whatever order they finish.
+    # If loading failed, result is None and error is the exception (ParserFail, BadBoardSize,
+    # FileNotFoundError, etc). Otherwise result is the root, or if summary is set, a small
+    # dict of the root's properties and the main line moves (see summarise()), which is
+    # much cheaper to send back from the workers.
+    #
+    # workers defaults to the number of CPUs; if it's 1 everything happens in this process.
+    # When using more than 1 worker on Windows, the calling script needs the usual
+    # if __name__ == "__main__" guard. How the speed scales with the number of workers has
+    # not been measured; for small files, sending the results back may well dominate.
+
+    if workers == 1:
+        for filename in filenames:
+            yield load_one(filename, summary)
+        return
+
+    job = functools.partial(load_one, summary = summary, flatten = True)
+
+    with multiprocessing.Pool(workers) as pool:
+        for filename, result, error in pool.imap_unordered(job, filenames, chunksize):
+            yield finish_one(filename, result, error)
+
+
+def load_one(filename, summary = False, flatten = False):       # Runs in the worker
+
+    try:
+        root = load(filename)
+    except Exception as e:
+        return filename, None, e
+
+    if summary:
+        return filename, summarise(root), None
+
+    if flatten:
+        return filename, flatten_tree(root), None
+
+    return filename, root, None
+
+
+def finish_one(filename, result, error):            # Runs back in the caller
+
+    if error is None and isinstance(result, list):
+        result = unflatten_tree(result)
+
+    return filename, result, error
+
+
+def summarise(root):
+
+    # Returns {"properties": <the root's properties>, "moves": [(colour, point), ...]} where
+    # point is an (x, y) tuple, or None for a pass.
+
+    size = int(root.properties["SZ"][0])
+    moves = []
+
+    node = root
+    while 1:
+        for key, colour in [("B", BLACK), ("W", WHITE)]:
+            if key in node.properties:
+                s = node.properties[key][0]
+                point = None
+                if len(s) >= 2:
+                    x, y = ord(s[0]) - 96, ord(s[1]) - 96
+                    if 1 <= x <= size and 1 <= y <= size:
+                        point = (x, y)
+                moves.append((colour, point))
+        if len(node.children) == 0:
+            break
+        node = node.children[0]
+
+    return {"properties": root.properties, "moves": moves}
+
+
+# Trees are sent between processes as flat lists of (parent index, properties) in the order
+# the nodes were reached, since pickling the nodes themselves recurses once per node.
+
+def flatten_tree(root):
+
+    flat = []
+    stack = [(root, -1)]
+
+    while stack:
+        node, parent_index = stack.pop()
+        index = len(flat)
+        flat.append((parent_index, node.properties))
+        for child in reversed(node.children):
+            stack.append((child, index))
+
+    return flat
+
+
+def unflatten_tree(flat):
+
+    nodes = []
+
+    for parent_index, properties in flat:
+        node = Node(parent = nodes[parent_index] if parent_index >= 0 else None)
+        node.properties = properties
+        nodes.append(node)
+
+    root = nodes[0]
+    root.is_main_line = True
+    root.update_recursive(update_board = False)
+
+    return root
@@ -0,0 +1,322 @@
+# An alternative to Board that keeps the black and white stones as two Python ints used as
+# bitboards, for bulk replay of games. Points are numbered as in Board, i.e. x, y is bit
+# x * (boardsize + 2) + y, so the border bits are always clear and a group can be grown by
+# shifting it 1 and boardsize + 2 either way and masking with the stones of its colour.
+#
+# It has the same methods as Board and gives identical positions (and hashes); the main
+# difference is that state and cells are snapshots, made when asked for; changing them does nothing.
+#
+# To use it for a whole tree, pass board_class = BitBoard to new_tree() or load().
+
+from gofish.constants import *
+from gofish.tree import *
+from gofish.utils import *
+
+mask_tables = dict()        # boardsize --> (mask of the points on the board, list of neighbour masks by point)
+
+
+def masks_for(boardsize):
+
+    if boardsize not in mask_tables:
+
+        width = boardsize + 2
+        on_board = 0
+        neighbours = [0] * (width * width)
+
+        for x in range(1, boardsize + 1):
+            for y in range(1, boardsize + 1):
+                p = x * width + y
+                on_board |= 1 << p
+                for q in (p - 1, p + 1, p - width, p + width):
+                    qx, qy = divmod(q, width)
+                    if 1 <= qx <= boardsize and 1 <= qy <= boardsize:
+                        neighbours[p] |= 1 << q
+
+        mask_tables[boardsize] = (on_board, neighbours)
+
+    return mask_tables[boardsize]
+
+
+class BitBoard():
+
+    __slots__ = ("boardsize", "width", "black", "white", "undo", "hash", "on_board", "neighbours", "__cells")
+
+    def __init__(self, boardsize):
+        self.boardsize = boardsize
+        self.width = boardsize + 2
+        self.black = 0
+        self.white = 0
+        self.undo = []                  # For each pushed node, the (black, white, hash) from before it
+        self.hash = zobrist_sizes[boardsize]
+        self.on_board, self.neighbours = masks_for(boardsize)
+        self.__cells = None
+
+    @property
+    def cells(self):                    # As Board.cells, but a copy; changing it does nothing
+        if self.__cells is None:
+            cells = bytearray([BORDER]) * (self.width * self.width)
+            for p in set_bits(self.on_board):
+                cells[p] = EMPTY
+            for p in set_bits(self.black):
+                cells[p] = BLACK
+            for p in set_bits(self.white):
+                cells[p] = WHITE
+            self.__cells = bytes(cells)
+        return self.__cells
+
+    @property
+    def state(self):                    # As Board.state, but a copy, as lists; changing it does nothing
+        cells = self.cells
+        return [[EMPTY if contents == BORDER else contents for contents in cells[x * self.width:x * self.width + self.boardsize + 1]]
+                for x in range(self.boardsize + 1)]
+
+    def as_array(self):                 # As Board.as_array(), but a copy
+        import numpy
+        view = numpy.frombuffer(self.cells, dtype = numpy.int8).reshape(self.width, self.width)
+        return view[1:-1, 1:-1].copy()
+
+    def colour_at(self, x, y):
+        bit = 1 << (x * self.width + y)
+        if self.black & bit:
+            return BLACK
+        if self.white & bit:
+            return WHITE
+        return EMPTY
+
+    def copy(self):
+        board = BitBoard.__new__(BitBoard)
+        board.boardsize = self.boardsize
+        board.width = self.width
+        board.black = self.black
+        board.white = self.white
+        board.undo = []
+        board.hash = self.hash
+        board.on_board = self.on_board
+        board.neighbours = self.neighbours
+        board.__cells = self.__cells
+        return board
+
+    def rehash(self):
+        self.hash = zobrist_sizes[self.boardsize]
+        for p in set_bits(self.black):
+            self.hash ^= zobrist_points[p * 3 + BLACK]
+        for p in set_bits(self.white):
+            self.hash ^= zobrist_points[p * 3 + WHITE]
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):
+        return (restore_bitboard, (self.boardsize, self.black, self.white))
+
+    dump = Board.dump
+
+    def __grow(self, group, stones):    # Flood fill: the whole group of stones that group is part of
+        width = self.width
+        while True:
+            grown = (group | group << 1 | group >> 1 | group << width | group >> width) & stones
+            if grown == group:
+                return group
+            group = grown
+
+    def __liberties(self, group):       # Mask of the liberties of a group
+        width = self.width
+        return (group << 1 | group >> 1 | group << width | group >> width) & self.on_board & ~(self.black | self.white)
+
+    def __stones_at(self, x, y):        # (bit, mask of that colour's stones), with the mask 0 if there's no stone
+        bit = 1 << (x * self.width + y)
+        if self.black & bit:
+            return bit, self.black
+        if self.white & bit:
+            return bit, self.white
+        return bit, 0
+
+    def group_has_liberties(self, x, y):
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        bit, stones = self.__stones_at(x, y)
+        assert(stones)
+        return self.__liberties(self.__grow(bit, stones)) != 0
+
+    def group(self, x, y):
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        bit, stones = self.__stones_at(x, y)
+        if not stones:
+            return set()
+        return {divmod(p, self.width) for p in set_bits(self.__grow(bit, stones))}
+
+    def liberties(self, x, y):
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        bit, stones = self.__stones_at(x, y)
+        if not stones:
+            return set()
+        return {divmod(p, self.width) for p in set_bits(self.__liberties(self.__grow(bit, stones)))}
+
+    def groups(self):
+        for stones in [self.black, self.white]:
+            while stones:
+                group = self.__grow(stones & -stones, stones)
+                stones &= ~group
+                yield {divmod(p, self.width) for p in set_bits(group)}, {divmod(p, self.width) for p in set_bits(self.__liberties(group))}
+
+    def play_move(self, colour, x, y):      # No legality checks, as per SGF standard. Returns the number of stones captured.
+        assert(colour in [BLACK, WHITE])
+
+        if x < 1 or x > self.boardsize or y < 1 or y > self.boardsize:
+            raise OffBoard
+
+        width = self.width
+        p = x * width + y
+        bit = 1 << p
+
+        if (self.black | self.white) & bit:     # There's a stone there already (the SGF standard allows it)
+            self.__remove(bit)
+
+        self.__cells = None
+        self.hash ^= zobrist_points[p * 3 + colour]
+
+        if colour == BLACK:
+            self.black |= bit
+            own, enemy = self.black, self.white
+        else:
+            self.white |= bit
+            own, enemy = self.white, self.black
+
+        neighbours = self.neighbours
+        on_board = self.on_board
+        empty = on_board & ~(own | enemy)
+
+        captures = 0
+
+        touching = neighbours[p] & enemy
+        while touching:
+            q = touching & -touching
+            touching ^= q
+            if neighbours[q.bit_length() - 1] & empty:          # The usual case, so check it before growing the group
+                continue
+            group = q
+            while True:
+                grown = (group | group << 1 | group >> 1 | group << width | group >> width) & enemy
+                if grown == group:
+                    break
+                group = grown
+            touching &= ~group
+            if (group << 1 | group >> 1 | group << width | group >> width) & empty == 0:
+                captures += self.__remove(group)
+                enemy &= ~group
+                empty |= group
+
+        # Check for and deal with suicide:
+
+        if neighbours[p] & empty == 0:
+            group = self.__grow(bit, own)
+            if self.__liberties(group) == 0:
+                self.__remove(group)
+
+        return captures
+
+    def preview_move(self, colour, x, y):   # As Board.preview_move()
+        assert(colour in [BLACK, WHITE])
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+
+        p = x * self.width + y
+        bit = 1 << p
+        assert((self.black | self.white) & bit == 0)
+
+        own = (self.black if colour == BLACK else self.white) | bit
+        enemy = self.white if colour == BLACK else self.black
+        opponent = BLACK if colour == WHITE else WHITE
+        empty = self.on_board & ~(own | enemy)
+
+        board_hash = self.hash ^ zobrist_points[p * 3 + colour]
+        captures = 0
+
+        touching = self.neighbours[p] & enemy
+        while touching:
+            group = self.__grow(touching & -touching, enemy)
+            touching &= ~group
+            if self.__liberties(group) & empty == 0:
+                for q in set_bits(group):
+                    board_hash ^= zobrist_points[q * 3 + opponent]
+                    captures += 1
+
+        if captures == 0 and self.__liberties(self.__grow(bit, own)) & empty == 0:
+            return None
+
+        return captures, board_hash
+
+    def destroy_group(self, x, y):
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        bit, stones = self.__stones_at(x, y)
+        assert(stones)
+        self.__remove(self.__grow(bit, stones))
+
+    def __remove(self, mask):               # Remove any stones in the mask. Returns the number removed
+        self.__cells = None
+        removed = 0
+        for colour in [BLACK, WHITE]:
+            stones = (self.black if colour == BLACK else self.white) & mask
+            if stones:
+                for p in set_bits(stones):
+                    self.hash ^= zobrist_points[p * 3 + colour]
+                    removed += 1
+                if colour == BLACK:
+                    self.black &= ~stones
+                else:
+                    self.white &= ~stones
+        return removed
+
+    def update_from_node(self, node, changes = None):
+
+        # As Board.update_from_node()
+
+        properties = node.properties
+        old_black, old_white = self.black, self.white
+
+        if "AB" in properties or "AW" in properties or "AE" in properties:
+            for adder, colour in [("AB", BLACK), ("AW", WHITE), ("AE", EMPTY)]:
+                for value in properties.get(adder, []):
+                    for point in points_from_points_string(value, self.boardsize):    # only returns points inside the board boundaries
+                        p = point[0] * self.width + point[1]
+                        self.__remove(1 << p)
+                        if colour == BLACK:
+                            self.black |= 1 << p
+                        elif colour == WHITE:
+                            self.white |= 1 << p
+                        self.hash ^= zobrist_points[p * 3 + colour]
+
+        for mover, colour in [("B", BLACK), ("W", WHITE)]:
+            if mover in properties:
+                movestring = properties[mover][0]
+                try:
+                    x = ord(movestring[0]) - 96
+                    y = ord(movestring[1]) - 96
+                    self.play_move(colour, x, y)
+                except (IndexError, OffBoard):
+                    pass
+
+        if changes is not None:
+            for p in set_bits((old_black ^ self.black) | (old_white ^ self.white)):
+                changes.append((p, BLACK if old_black >> p & 1 else WHITE if old_white >> p & 1 else EMPTY))
+
+    def push_node(self, node):
+        self.undo.append((self.black, self.white, self.hash))
+        self.update_from_node(node)
+
+    def pop(self):                          # Revert the most recent push_node()
+        self.black, self.white, self.hash = self.undo.pop()
+        self.__cells = None
+
+
+def set_bits(mask):                             # Yield the index of each set bit, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def restore_bitboard(boardsize, black, white):
+    board = BitBoard(boardsize)
+    board.black = black
+    board.white = white
+    board.rehash()
+    return board
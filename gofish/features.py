@@ -0,0 +1,137 @@
+# Turning positions into NumPy arrays, e.g. as training data for a network. NumPy is optional:
+# without it, the rest of gofish works as before, but extract_features() raises ImportError.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gofish.constants import *
+from gofish.loader import *
+from gofish.tree import *
+
+__all__ = ["feature_planes", "default_planes", "extract_features", "liberty_counts"]     # Not numpy, etc
+
+# The planes that extract_features() can make. Each is a boardsize x boardsize array of 0 and 1,
+# indexed [x - 1, y - 1] like Board.as_array():
+#
+#   black, white, empty     where the stones are (or aren't)
+#   liberties_1 ... _3      stones whose group has 1, 2, or 3 or more liberties
+#   last_move_1 ... _8      the point of the most recent move, the one before that, etc (all 0 for a pass)
+#   black_to_play           all 1 if Black is to play next, else all 0
+
+feature_planes = ["black", "white", "empty", "liberties_1", "liberties_2", "liberties_3"] + \
+                 ["last_move_{}".format(n) for n in range(1, 9)] + ["black_to_play"]
+
+default_planes = ["black", "white", "empty", "liberties_1", "liberties_2", "liberties_3", "last_move_1", "black_to_play"]
+
+
+def extract_features(games, planes = None, out = None, filename = None):
+
+    # Replay the main line of each game (a root, or a filename to load) and fill in the planes
+    # for the position at every node of every main line, in order. The result has the shape
+    # (positions, planes, boardsize, boardsize) and dtype int8. It goes into out, if that's
+    # given and the right shape; else into a new .npy file called filename (as a memory-mapped
+    # array, so it needn't fit in memory); else into a new array. All games must have the
+    # same board size. Returns the array.
+
+    if numpy is None:
+        raise ImportError("extract_features() needs numpy")
+
+    planes = list(planes or default_planes)
+
+    for plane in planes:
+        if plane not in feature_planes:
+            raise ValueError("unknown feature plane: {}".format(plane))
+
+    # First pass: find the board size and the length of each main line, so we know how big the
+    # result is. Only the lengths are kept; games given as filenames are loaded again below...
+
+    games = list(games)
+    counts = []
+    size = None
+
+    for game in games:
+        root = load_sgf_mainline(game) if isinstance(game, str) else game
+        game_size = int(root.properties["SZ"][0]) if "SZ" in root.properties else 19
+        if size is None:
+            size = game_size
+        elif game_size != size:
+            raise BadBoardSize
+        counts.append(sum(1 for node in walk_mainline(root)))
+
+    shape = (sum(counts), len(planes), size or 19, size or 19)
+
+    if out is not None:
+        if out.shape != shape:
+            raise ValueError("out has shape {}, needs {}".format(out.shape, shape))
+    elif filename is not None:
+        out = numpy.lib.format.open_memmap(filename, mode = "w+", dtype = numpy.int8, shape = shape)
+    else:
+        out = numpy.zeros(shape, dtype = numpy.int8)
+
+    # Second pass: replay each main line on a single board, gathering its positions, then
+    # write each plane for the whole game at once...
+
+    need_liberties = any(plane.startswith("liberties_") for plane in planes)
+    i = 0
+
+    for game, count in zip(games, counts):
+
+        root = load_sgf_mainline(game) if isinstance(game, str) else game
+        board = Board(size)
+        stones = numpy.empty((count, size, size), dtype = numpy.int8)
+        liberties = numpy.empty((count, size, size), dtype = numpy.int16) if need_liberties else None
+        moves = []                      # (x, y) of each move played, None for a pass
+        made = numpy.empty(count, dtype = numpy.int32)      # How many moves have been played at each position
+        black_to_play = numpy.empty(count, dtype = numpy.int8)
+
+        for n, node in enumerate(walk_mainline(root)):
+            board.update_from_node(node)
+            stones[n] = board.as_array()
+            if need_liberties:
+                liberties[n] = liberty_counts(board)
+            if "B" in node.properties or "W" in node.properties:
+                moves.append(node.move_coords())
+            made[n] = len(moves)
+            black_to_play[n] = node.last_colour_played() != BLACK
+
+        block = out[i:i + count]
+
+        for k, plane in enumerate(planes):
+            if plane == "black":
+                block[:, k] = stones == BLACK
+            elif plane == "white":
+                block[:, k] = stones == WHITE
+            elif plane == "empty":
+                block[:, k] = stones == EMPTY
+            elif plane == "liberties_3":
+                block[:, k] = liberties >= 3
+            elif plane.startswith("liberties_"):
+                block[:, k] = liberties == int(plane[-1])
+            elif plane.startswith("last_move_"):
+                block[:, k] = 0
+                shown = [(n, moves[j]) for n, j in enumerate(made - int(plane[len("last_move_"):])) if j >= 0 and moves[j]]
+                if shown:
+                    block[[n for n, move in shown], k, [move[0] - 1 for n, move in shown], [move[1] - 1 for n, move in shown]] = 1
+            elif plane == "black_to_play":
+                block[:, k] = black_to_play[:, None, None]
+
+        i += count
+
+    if isinstance(out, numpy.memmap):
+        out.flush()
+
+    return out
+
+
+def liberty_counts(board):              # A (boardsize, boardsize) array of the liberties of the group at each point, 0 if empty
+
+    size = board.boardsize
+    counts = [0] * (size * size)
+
+    for points, liberties in board.groups():
+        for x, y in points:
+            counts[(x - 1) * size + y - 1] = len(liberties)
+
+    return numpy.array(counts, dtype = numpy.int16).reshape(size, size)
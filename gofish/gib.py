@@ -44,16 +44,20 @@ def parse_player_name(raw):
     return name, rank
 
 
-def parse_gib(gib):
+def parse_gib(gib, header_only = False, max_moves = None):     # header_only: stop at the first move
 
     root = Node(parent = None)
     node = root
 
-    lines = gib.split("\n")
+    moves = 0
+    recognised = False          # Have we seen anything that looks like GIB?
 
-    for line in lines:
+    for line in iter_lines(gib):
         line = line.strip()
 
+        if line.startswith("\\[GAME") or line[0:3] in ["INI", "STO"]:
+            recognised = True
+
         if line.startswith("\\[GAMEBLACKNAME=") and line.endswith("\\]"):
 
             s = line[16:-2]
@@ -133,6 +137,12 @@ def parse_gib(gib):
 
         if line[0:3] == "STO":
 
+            if header_only:
+                break
+
+            if max_moves is not None and moves >= max_moves:
+                break
+
             move = line.split()
 
             key = "B" if move[3] == "1" else "W"
@@ -154,8 +164,12 @@ def parse_gib(gib):
 
             node = Node(parent = node)
             node.set_value(key, value)
+            moves += 1
+
+    if len(root.children) == 0 and not header_only:     # We'll assume we failed in this case
+        raise ParserFail
 
-    if len(root.children) == 0:     # We'll assume we failed in this case
+    if not recognised:
         raise ParserFail
 
     return root
@@ -1,70 +1,211 @@
 # Internally, everything is stored as SGF (or rather a tree-structure that incorporates properties like SGF's).
 # See tree.py for the implementation.
 
+import itertools
+import mmap
+import os
+import re
+
 from gofish.gib import *
 from gofish.ngf import *
 from gofish.sgf import *
 from gofish.ugf import *
 
-def load(filename):
+# GIB files can be in various different encodings, I think, so no attempt to switch to GBK
+# or whatever. NGF seem to use GB18030. UGF seem to usually be in Shift-JIS encoding.
 
-    with open(filename, encoding="utf8", errors="replace") as infile:
-        contents = infile.read()
+format_encodings = {"gib": "utf8", "ngf": "gb18030", "ugf": "shift_jisx0213"}
+format_parsers = {"gib": parse_gib, "ngf": parse_ngf, "ugf": parse_ugf}
+
+
+def detect_format(prefix):
+
+    # Guess the format from the first few KB of a file. Returns "sgf", "gib", "ngf", "ugf"
+    # or None if unsure.
+
+    if isinstance(prefix, str):
+        prefix = prefix.encode("utf8", errors="replace")
+
+    if b"\\[GAMEBLACKNAME=" in prefix or b"\\[GAMEWHITENAME=" in prefix or b"\\[GAMEINFOMAIN=" in prefix:
+        return "gib"
+
+    if re.search(rb"^\s*\[header\]\s*$", prefix, re.IGNORECASE | re.MULTILINE):
+        return "ugf"
+
+    if re.match(rb"(\xef\xbb\xbf)?\s*\(+\s*;", prefix):       # Possibly with a UTF-8 BOM
+        return "sgf"
+
+    # NGF has a fixed layout: board size on line 2, handicap on line 6, then moves like PMABBQE
+
+    lines = prefix.split(b"\n")
+    try:
+        int(lines[1])
+        int(lines[5])
+        for line in lines[11:]:
+            if line.startswith(b"PM"):
+                return "ngf"
+    except (IndexError, ValueError):
+        pass
+
+    return None
+
+
+def format_from_extension(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".ugi":
+        return "ugf"
+    return extension[1:]
+
+
+def load(filename, lazy = False, board_class = None, weak_parents = False):
 
     # FileNotFoundError is just allowed to bubble up
+    #
+    # The file is mapped into memory rather than read and decoded as a whole; the SGF parser
+    # finds the structure in the raw bytes and decodes only the values, with the right codec.
+    # The format is sniffed from the start of the file; if that's unclear, we try SGF and
+    # then go by the file extension.
+    #
+    # If lazy is set, SGF variations are only parsed when first looked at (see LazyNode). The
+    # lazy tree keeps its own copy of the bytes rather than the mapping, since the file may be
+    # changed (e.g. saved over) while unparsed parts of the tree still need it.
+    # If board_class is given (e.g. BitBoard), the tree's boards are of that class.
+    # If weak_parents is set, the tree is freed as soon as its root is dropped (see set_weak_parents).
+
+    data = map_file(filename)
 
     try:
-        root = parse_sgf(contents)
+        if lazy:
+            root = parse_data(bytes(data), filename, parse_sgf_lazy)    # A copy, see above
+        else:
+            root = parse_data(data, filename, parse_sgf_bytes)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
 
-    except ParserFail:      # All the parsers below can themselves raise ParserFail
+    cleanup(root, update = not isinstance(root, LazyNode))     # Lazy trees set up their nodes as they go
 
-        if filename[-4:].lower() == ".gib":
-            print("Parsing as SGF failed, trying to parse as GIB")
+    if board_class is not None:
+        set_board_class(root, board_class)
 
-            # These can be in variousdifferent encodings, I think,
-            # so no attempt to switch to GBK or whatever...
+    if weak_parents:
+        set_weak_parents(root)
 
-            root = parse_gib(contents)
+    return root
 
-        elif filename[-4:].lower() == ".ngf":
-            print("Parsing as SGF failed, trying to parse as NGF")
 
-            # These seem to use GB18030:
+def parse_data(data, filename, sgf_parser, header_only = False):
 
-            with open(filename, encoding="gb18030", errors="replace") as infile:
-                contents = infile.read()
+    # The format is sniffed from the start of the data; if that's unclear, we try SGF (with
+    # the given parser) and then go by the file extension.
 
-            root = parse_ngf(contents)
+    file_format = detect_format(data[0:4096])
 
-        elif filename[-4:].lower() in [".ugf", ".ugi"]:
-            print("Parsing as SGF failed, trying to parse as UGF")
+    if file_format in [None, "sgf"]:
+        try:
+            return sgf_parser(data)
+        except ParserFail:      # All the parsers below can themselves raise ParserFail
+            file_format = file_format or format_from_extension(filename)
+            if file_format not in format_parsers:
+                raise
+            print("Parsing as SGF failed, trying to parse as {}".format(file_format.upper()))
 
-            # These seem to usually be in Shift-JIS encoding, hence:
+    return format_parsers[file_format](str(data, format_encodings[file_format], errors="replace"), header_only = header_only)
 
-            with open(filename, encoding="shift_jisx0213", errors="replace") as infile:
-                contents = infile.read()
 
-            root = parse_ugf(contents)
+def map_file(filename):
+
+    # Return a read-only mmap of the file, or just its bytes if it can't be mapped (e.g. it's empty).
+
+    with open(filename, "rb") as infile:
+        try:
+            return mmap.mmap(infile.fileno(), 0, access = mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return infile.read()
 
-        else:
-            raise
+
+def load_sgf_mainline(filename, max_moves = None):
+
+    # If max_moves is given, reading the file stops once that many moves have been read.
+
+    with open(filename, encoding="utf8", errors="replace") as infile:
+        root = parse_sgf_stream(infile, main_line_only = True, max_moves = max_moves)
 
     cleanup(root)
     return root
 
 
-def load_sgf_mainline(filename):
+def iter_sgf_games(source, chunk_size = 65536, encoding = "utf-8"):
 
-    with open(filename, encoding="utf8", errors="replace") as infile:
-        contents = infile.read()
+    # Lazily yield the root of each game tree in an SGF collection, e.g. (;...)(;...)(;...)
+    # The source can be a filename or a file object, in text or binary mode (binary is
+    # decoded with the given encoding). Only one game is parsed at a time. A game that
+    # can't be parsed is skipped, with a message, and the rest are still read.
+
+    if isinstance(source, str):
+        with open(source, encoding="utf8", errors="replace") as infile:
+            yield from iter_sgf_games(infile, chunk_size)
+        return
+
+    depth = [0]         # How many "(" we are inside, so that a bad game can be skipped to its end
+
+    def counted(tokens):
+        for token in tokens:
+            if token[0] == "(":
+                depth[0] += 1
+            elif token[0] == ")" and depth[0] > 0:
+                depth[0] -= 1
+            yield token
+
+    tokens = counted(sgf_chunk_tokens(read_chunks(source, chunk_size), encoding = encoding))
+    number = 0
+
+    for kind, __ in tokens:
+        if kind != "(":
+            continue            # Anything between game trees is ignored
+
+        number += 1
 
-    root = parse_sgf(contents, main_line_only = True)
+        # Like parse_sgf(), treat a run of leading "(" as a single one...
+
+        try:
+            root, __ = build_sgf_tree(itertools.dropwhile(lambda token: token[0] == "(", tokens), None)
+            cleanup(root)
+        except (ParserFail, BadBoardSize, ValueError):
+            print("Skipping game {} of the collection, it couldn't be parsed".format(number))
+            while depth[0] > 0 and next(tokens, None) is not None:
+                pass
+            continue
+
+        yield root
+
+
+def read_chunks(infile, chunk_size):        # Until the first empty read, whether the file is text or binary
+    while 1:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_header(filename):
+
+    # Load just the root node, with the game info (PB, PW, DT, RE, KM, SZ, HA...), without
+    # parsing the moves. For SGF, only the pages of the file up to the end of the root are read.
+
+    data = map_file(filename)
+
+    try:
+        root = parse_data(data, filename, lambda data: parse_sgf_bytes(data, header_only = True), header_only = True)
+    finally:
+        if isinstance(data, mmap.mmap):
+            data.close()
 
     cleanup(root)
     return root
 
 
-def cleanup(root):
+def cleanup(root, update = True):
 
     root.set_value("FF", 4)
     root.set_value("GM", 1)
@@ -83,6 +224,7 @@ def cleanup(root):
     # when loading a file, but still need to update main line status and moves played:
 
     root.is_main_line = True
-    root.update_recursive(update_board = False)
+    if update:
+        root.update_recursive(update_board = False)
 
     return root
@@ -1,13 +1,16 @@
 # Another poorly documented file format. Wbaduk uses this.
 
+import itertools
+
 from gofish.constants import *
 from gofish.tree import *
 from gofish.utils import *
 
-def parse_ngf(ngf):
+def parse_ngf(ngf, header_only = False, max_moves = None):     # header_only: skip the moves
 
     ngf = ngf.strip()
-    lines = ngf.split("\n")
+    remaining = iter_lines(ngf)
+    lines = list(itertools.islice(remaining, 11))       # The fixed-layout header; moves are read as needed
 
     try:
         boardsize = int(lines[1])
@@ -21,6 +24,8 @@ def parse_ngf(ngf):
             komi += 0.5
 
     except (IndexError, ValueError):
+        if header_only:                 # The header is all we'd get, so this isn't NGF
+            raise ParserFail
         boardsize = 19
         handicap = 0
         pw = ""
@@ -73,9 +78,18 @@ def parse_ngf(ngf):
     if re:
         root.set_value("RE", re)
 
+    if header_only:
+        return root
+
     # Main parser...
 
-    for line in lines:
+    moves = 0
+
+    for line in itertools.chain(lines, remaining):
+
+        if max_moves is not None and moves >= max_moves:
+            break
+
         line = line.strip().upper()
 
         if len(line) >= 7:
@@ -97,6 +111,7 @@ def parse_ngf(ngf):
 
                     node = Node(parent = node)
                     node.set_value(key, value)
+                    moves += 1
 
     if len(root.children) == 0:     # We'll assume we failed in this case
         raise ParserFail
@@ -1,84 +1,501 @@
+import codecs
+import re
+
 from gofish.constants import *
 from gofish.tree import *
 
+# The tokenizer works on offsets into the text and yields (kind, value) pairs:
+#
+#   "("     value is the offset of the "("
+#   ")"     value is the offset just past the ")", i.e. characters read so far
+#   ";"     value is the offset of the ";"
+#   "K"     value is a run of uppercase letters (part of a key)
+#   "V"     value is a complete property value, with escape slashes removed
+#
+# Everything else outside of values (whitespace, lowercase letters, etc) is skipped.
+#
+# The text can also be bytes (or an mmap). In that case the structure is found in the
+# raw bytes, and only keys and values get decoded, one at a time, as they are reached.
+
+_structure_regex = {str: re.compile(r"[A-Z]+|[\[();]"), bytes: re.compile(rb"[A-Z]+|[\[();]")}
+_syntax_chars = {str: ("]", "\\"), bytes: (b"]", b"\\")}
+_token_kinds = {"[": "[", "(": "(", ")": ")", ";": ";", b"[": "[", b"(": "(", b")": ")", b";": ";"}
+
+
+def sgf_tokens(sgf, pos = 0, encoding = "utf-8"):
+    return sgf_chunk_tokens((sgf,), pos, encoding)
+
+
+def sgf_chunk_tokens(chunks, pos = 0, encoding = "utf-8"):
+
+    # As above, but the text arrives as an iterable of chunks. A value (or an escape)
+    # can be split across chunks, so the pieces of an unfinished value are carried over.
+    # Offsets are relative to the start of the whole text.
+
+    base = 0            # Offset of the current chunk within the whole text
+    parts = None        # Pieces of the value we are inside of, if any
+    escaped = False     # Did the last chunk end with an escape slash?
+
+    for chunk in chunks:
+
+        binary = not isinstance(chunk, str)
+        regex = _structure_regex[bytes if binary else str]
+        close_char, escape_char = _syntax_chars[bytes if binary else str]
+
+        length = len(chunk)
+
+        if escaped and length:
+            parts.append(chunk[0:1])
+            pos = 1
+            escaped = False
+
+        while 1:
+
+            if parts is not None:
+                close = chunk.find(close_char, pos)
+                if close == -1:
+                    close = length
+                escape = chunk.find(escape_char, pos, close)
+                if escape == -1:
+                    parts.append(chunk[pos:close])
+                    if close == length:
+                        break                                   # The value continues in the next chunk
+                    pos = close + 1
+                    value = close_char[0:0].join(parts)
+                    if binary:
+                        value = value.decode(encoding, errors = "replace")
+                    yield "V", value
+                    parts = None
+                    continue
+                parts.append(chunk[pos:escape])                 # Discard the escape slash but keep the next char...
+                if escape + 1 == length:
+                    escaped = True
+                    break
+                parts.append(chunk[escape + 1:escape + 2])
+                pos = escape + 2
+                continue
+
+            match = regex.search(chunk, pos)
+            if match is None:
+                break
+
+            c = match.group()
+            pos = match.end()
+
+            kind = _token_kinds.get(c)
+
+            if kind is None:
+                yield "K", c.decode("ascii") if binary else c
+            elif kind == "[":
+                parts = []
+            elif kind == ")":
+                yield ")", base + pos
+            else:
+                yield kind, base + pos - 1
+
+        base += length
+        pos = 0
+
+    if escaped:
+        raise ParserFail
+
+    # An unterminated value at the end is silently dropped.
+
+
+def sgf_encoding(data):
+
+    # Given the raw bytes of an SGF file, return the codec named by the root's CA property,
+    # or UTF-8 if there isn't one or Python doesn't know it.
+
+    try:
+        pos = _leading_bytes_regex.match(data).end()
+        root, __ = build_sgf_tree(sgf_tokens(data, pos, "latin-1"), None, header_only = True)
+        return codecs.lookup(root.get_value("CA")).name
+    except (ParserFail, KeyError, LookupError, TypeError):
+        return "utf-8"
+
+
+def byte_scannable(encoding):
+
+    # Can the SGF syntax chars be found in the raw bytes? Not in encodings such as Shift-JIS or GBK
+    # where they can also be the 2nd byte of a character. This only lists the common safe ones.
+
+    name = codecs.lookup(encoding).name
+    if name in ["utf-8", "ascii", "euc_jp", "euc_kr", "gb2312"]:
+        return True
+    return name.startswith("iso8859") or name.startswith("cp125")
+
+
+def sgf_file_chunks(infile, chunk_size = 65536):
+
+    # Read a file in chunks, stripping the text and discarding the leading "(" chars, like
+    # parse_sgf() does. Trailing whitespace is held back until we know it isn't at the end.
+    # The file can be in text or binary mode; the chunks are str or bytes accordingly.
+
+    stage = 0
+    held = ""
+
+    while 1:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            return
+        if stage == 0:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            stage = 1
+        if stage == 1:
+            chunk = chunk.lstrip("(" if isinstance(chunk, str) else b"(")
+            if not chunk:
+                continue
+            stage = 2
+        if held:
+            chunk = held + chunk
+        stripped = chunk.rstrip()
+        held = chunk[len(stripped):]
+        if stripped:
+            yield stripped
+
+
+def parse_sgf_header(sgf):
+
+    # Parse only the root node (e.g. for indexing PB, PW, DT, RE...); tokenizing stops at the end of it.
 
-def parse_sgf(sgf, main_line_only = False):
+    sgf = sgf.strip()
+    sgf = sgf.lstrip("(")
+
+    root, __ = build_sgf_tree(sgf_tokens(sgf), None, header_only = True)
+    return root
+
+
+_leading_bytes_regex = re.compile(rb"(\xef\xbb\xbf)?\s*\(*")        # Possibly with a UTF-8 BOM, as detect_format() allows
+
+
+def parse_sgf(sgf, main_line_only = False, max_moves = None):      # max_moves requires main_line_only
     sgf = sgf.strip()
     sgf = sgf.lstrip("(")       # the load_sgf_tree() function assumes the leading "(" has already been read and discarded
 
-    if main_line_only:
-        root, __ = load_sgf_tree(sgf, None, main_line_only = True)
-    else:
-        root, __ = load_sgf_tree(sgf, None)
+    root, __ = load_sgf_tree(sgf, None, main_line_only = main_line_only, max_moves = max_moves)
+    return root
+
 
+def parse_sgf_bytes(data, encoding = None, main_line_only = False, header_only = False):
+
+    # Parse raw bytes, or an mmap of the file, without decoding the whole thing. If no encoding
+    # is given, the one named by the root's CA property is used (or else UTF-8).
+
+    if encoding is None:
+        encoding = sgf_encoding(data)
+
+    if not byte_scannable(encoding):
+        text = str(data, encoding, errors = "replace")
+        if header_only:
+            return parse_sgf_header(text)
+        return parse_sgf(text, main_line_only)
+
+    pos = _leading_bytes_regex.match(data).end()        # Like the strip() and lstrip("(") in parse_sgf()
+
+    root, __ = build_sgf_tree(sgf_tokens(data, pos, encoding), None, main_line_only, header_only)
     return root
 
 
-def load_sgf_tree(sgf, parent_of_local_root, main_line_only = False):   # The caller should ensure there is no leading "("
+def parse_sgf_stream(infile, chunk_size = 65536, main_line_only = False, header_only = False, max_moves = None, encoding = "utf-8"):     # max_moves requires main_line_only
+
+    # Like parse_sgf() but reads from a file object (or stdin, a pipe, etc) in chunks,
+    # so the whole text never needs to be in memory at once. The file can be in text or
+    # binary mode (e.g. sys.stdin.buffer); binary is decoded with the given encoding.
+
+    tokens = sgf_chunk_tokens(sgf_file_chunks(infile, chunk_size), encoding = encoding)
+    root, __ = build_sgf_tree(tokens, None, main_line_only = main_line_only, header_only = header_only, max_moves = max_moves)
+    return root
+
+
+def load_sgf_tree(sgf, parent_of_local_root, main_line_only = False, max_moves = None):   # The caller should ensure there is no leading "("
+
+    root, chars_read = build_sgf_tree(sgf_tokens(sgf), parent_of_local_root, main_line_only, max_moves = max_moves)
+    if chars_read is None:
+        chars_read = len(sgf)
+    return root, chars_read
+
+
+def build_sgf_tree(tokens, parent_of_local_root, main_line_only = False, header_only = False, max_moves = None):
+
+    # Builds the tree from a token stream in a single pass. Rather than recursing
+    # at every "(" we push the state of the enclosing tree onto an explicit stack,
+    # so there is no limit on how deeply variations can nest.
+    #
+    # If header_only is set, we stop consuming tokens as soon as the root node ends. If max_moves
+    # is set (which requires main_line_only) we stop once a node brings the count up to it.
+    #
+    # Returns the root and the characters read (None if the input simply ran out).
+
+    if max_moves is not None and not main_line_only:
+        raise ValueError("max_moves requires main_line_only")
+
+    stack = []
 
     root = None
     node = None
+    key = ""
+    keycomplete = False
+
+    moves = 0
+
+    for kind, value in tokens:
+
+        if kind == "V":
+            if node is None:
+                raise ParserFail
+            node.add_value(key, value)
+            keycomplete = True
+        elif kind == "K":
+            if keycomplete:             # Other chars were skipped, e.g. AddWhite becomes AW (saw this once)
+                key = ""
+                keycomplete = False
+            key += value
+        elif kind == ";":
+            if node is None:
+                node = Node(parent = parent_of_local_root)
+                root = node
+            elif header_only:
+                return root, value
+            else:
+                if max_moves is not None:
+                    moves += node.moves_in_this_node()
+                    if moves >= max_moves:
+                        return root, value
+                node = Node(parent = node)
+        elif kind == "(":
+            if header_only and node is not None:
+                return root, value
+            if main_line_only:
+                continue
+            if node is None:
+                raise ParserFail
+            stack.append((root, node, parent_of_local_root, key, keycomplete))
+            root, node, parent_of_local_root = None, None, node     # The new local tree will be appended to the node
+            key, keycomplete = "", False
+        elif kind == ")":
+            if root is None:
+                raise ParserFail
+            if main_line_only or len(stack) == 0:
+                return root, value
+            root, node, parent_of_local_root, key, keycomplete = stack.pop()
+
+    if root is None:
+        raise ParserFail
+
+    if stack:
+        root = stack[0][0]
+
+    return root, None
+
+# ---------------------------------------------------------------------------
+# Lazy loading. A single fast scan matches up the brackets, and after that the
+# variations of a node are only parsed (into LazyNodes) when its children are
+# first needed. Unparsed variations are saved verbatim.
+
+_bracket_regex = {str: re.compile(r"[\[()]"), bytes: re.compile(rb"[\[()]")}
+_node_start_regex = {str: re.compile(r"[\[();]"), bytes: re.compile(rb"[\[();]")}
+
+
+def match_sgf_brackets(sgf, start = 0):
+
+    # Returns a dict of: offset of "(" ---> offset just past its matching ")"
+    # Brackets inside values are skipped. Unmatched "(" are left out.
+    #
+    # The scan starts at start, after any leading "(" of the root. It raises ParserFail
+    # if a "(" isn't followed by a node, as the full parser would, so that a lazy load
+    # fails up front rather than when the bad variation is looked at.
+
+    binary = not isinstance(sgf, str)
+    regex = _bracket_regex[bytes if binary else str]
+    node_regex = _node_start_regex[bytes if binary else str]
+    close_char, escape_char = _syntax_chars[bytes if binary else str]
+
+    matches = dict()
+    opened = []
+
+    pos = start
+
+    while 1:
+
+        match = regex.search(sgf, pos)
+        if match is None:
+            break
+
+        c = _token_kinds[match.group()]
+        pos = match.end()
+
+        if c == "[":
+            while 1:
+                close = sgf.find(close_char, pos)
+                if close == -1:
+                    return matches                  # Unterminated value
+                escape = sgf.find(escape_char, pos, close)
+                if escape == -1:
+                    pos = close + 1
+                    break
+                pos = escape + 2
+        elif c == "(":
+            match = node_regex.search(sgf, pos)
+            if match is None or _token_kinds[match.group()] != ";":
+                raise ParserFail
+            opened.append(pos - 1)
+        elif opened:
+            matches[opened.pop()] = pos
+
+    return matches
+
+
+class LazySource():
+    def __init__(self, sgf, encoding = "utf-8", start = 0):    # sgf can be a str, or bytes / mmap in the given encoding
+        self.sgf = sgf
+        self.encoding = encoding
+        self.matches = match_sgf_brackets(sgf, start)
+
+    def span_text(self, span):
+        start, end = span
+        if end is None:                             # "(" was never closed
+            text = self.sgf[start:]
+        else:
+            text = self.sgf[start:end]
+        if not isinstance(text, str):
+            text = text.decode(self.encoding, errors = "replace")
+        if end is None:
+            text += ")"
+        return text
+
+
+class LazyNode(Node):
+
+    # A node whose variations are kept as (start, end) spans of the source text
+    # until something looks at its children. So anything that reads .children of
+    # every node parses the whole tree, e.g. walk(), clear_markup_recursive() and
+    # the other whole-tree searches. Saving, set_weak_parents(), unlink_recursive()
+    # and board invalidation leave unparsed variations alone (see parsed_children()).
+
+    __slots__ = ("__children", "__spans", "__source")
+
+    def __init__(self, parent, source = None):
+        Node.__init__(self, parent)                 # This sets .children and so clears the spans below
+        self.__source = source
+
+    @property
+    def children(self):
+        if self.__spans is not None:
+            self.expand()
+        return self.__children
 
-    inside = False      # Are we inside a value? i.e. in C[foo] the value is foo
-    value = ""
+    @children.setter
+    def children(self, children):
+        self.__children = children
+        self.__spans = None
+
+    def set_unparsed(self, spans):
+        self.__spans = spans or None
+
+    def parsed_children(self):
+        return self.__children
+
+    def unparsed_variations(self):
+        if self.__spans is None:
+            return None
+        return [self.__source.span_text(span) for span in self.__spans]
+
+    def expand(self):
+        spans = self.__spans
+        self.__spans = None                         # Must happen first, since new children get appended
+        if spans:
+            for start, end in spans:
+                parse_lazy_sequence(self.__source, start + 1, self)
+
+
+def parse_lazy_sequence(source, pos, parent):
+
+    # Parse the sequence of nodes starting at pos (just after its "(") up to its closing ")".
+    # Any variations at the end are not parsed, merely noted as spans in the last node.
+    # Main line status and move counts are set as we go. Returns the first node.
+
+    sgf = source.sgf
+
+    first = None
+    node = None
     key = ""
     keycomplete = False
-    chars_to_skip = 0
+    spans = []
 
-    for i, c in enumerate(sgf):
+    while pos is not None:
 
-        if chars_to_skip:
-            chars_to_skip -= 1
-            continue
+        tokens = sgf_tokens(sgf, pos, source.encoding)
+        pos = None
 
-        if inside:
-            if c == "\\":
-                # value += "\\"        # Do not do this. Discard the escape slash.
-                try:
-                    value += sgf[i + 1]
-                except IndexError:
-                    raise ParserFail
-                chars_to_skip = 1
-            elif c == "]":
-                inside = False
+        for kind, value in tokens:
+
+            if kind == "V":
                 if node is None:
                     raise ParserFail
                 node.add_value(key, value)
-            else:
-                value += c
-        else:
-            if c == "[":
-                value = ""
-                inside = True
                 keycomplete = True
-            elif c == "(":
-                if main_line_only:
-                    continue
-                if node is None:
-                    raise ParserFail
-                __, chars_to_skip = load_sgf_tree(sgf[i + 1:], node)    # The child function will append the new tree to the node
-            elif c == ")":
-                if main_line_only:
-                    break
-                if root is None:
-                    raise ParserFail
-                return root, i + 1          # return characters read
-            elif c == ";":
+            elif kind == "K":
+                if keycomplete:
+                    key = ""
+                    keycomplete = False
+                key += value
+            elif kind == ";":
                 if node is None:
-                    newnode = Node(parent = parent_of_local_root)
-                    root = newnode
-                    node = newnode
+                    node = LazyNode(parent, source)
+                    first = node
                 else:
-                    newnode = Node(parent = node)
-                    node = newnode
-            else:
-                if c in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":   # Other chars are skipped, e.g. AddWhite becomes AW (saw this once)
-                    if keycomplete:
-                        key = ""
-                        keycomplete = False
-                    key += c
+                    finish_lazy_node(node)
+                    if spans:                       # Malformed, e.g. (;B[aa](;W[bb]);W[cc]) - this makes
+                        node.set_unparsed(spans)    # W[cc] a sibling of W[bb], as the full parser does
+                        node.expand()
+                        spans = []
+                    node = LazyNode(node, source)
+            elif kind == "(":
+                if node is None:
+                    raise ParserFail
+                end = source.matches.get(value)
+                spans.append((value, end))
+                pos = end                           # Restart the tokenizer after the variation (if it ended)
+                break
+            elif kind == ")":
+                break
 
-    if root is None:
+    if node is None:
         raise ParserFail
 
-    return root, i + 1          # return characters read
+    finish_lazy_node(node)
+    node.set_unparsed(spans)
+
+    return first
+
+
+def finish_lazy_node(node):
+    if node.parent:
+        node.parent.copy_state_to_child(node, copy_board = False)
+    else:
+        node.is_main_line = True
+    node.update(update_board = False)
+
+
+def parse_sgf_lazy(sgf, encoding = None):
+
+    # Like parse_sgf() but returns a tree of LazyNodes which parse their variations on demand.
+    # The text is kept (by reference) for as long as any of the tree is unparsed. It can be
+    # raw bytes or an mmap, as with parse_sgf_bytes().
+
+    if isinstance(sgf, str):
+        sgf = sgf.strip()
+        start = len(sgf) - len(sgf.lstrip("("))
+        return parse_lazy_sequence(LazySource(sgf, start = start), start, None)
+
+    if encoding is None:
+        encoding = sgf_encoding(sgf)
+
+    if not byte_scannable(encoding):
+        return parse_sgf_lazy(str(sgf, encoding, errors = "replace"))
+
+    start = _leading_bytes_regex.match(sgf).end()
+    return parse_lazy_sequence(LazySource(sgf, encoding, start), start, None)
@@ -0,0 +1,426 @@
+# A compact alternative to a tree of Node objects, for very large trees (e.g. an opening
+# database). The tree is kept as columns of machine integers, one entry per node:
+#
+#   parents         index of the parent, or -1 for the root
+#   first_children  index of the first child, or -1
+#   next_siblings   index of the next sibling, or -1
+#   moves           the node's move, packed as colour | x << 2 | y << 7 (0 if no move)
+#   moves_made      as Node.moves_made
+#   main_line       as Node.is_main_line
+#
+# Anything else (comments, setup stones, game info, odd moves) goes in a side table.
+# That's roughly 19 bytes per plain move node, against several hundred for a Node.
+#
+# store.node(i) returns a StoreNode, a Node-compatible view of node i, so the usual methods
+# (make_move, children, parent, write_tree, dyer...) work. Whole-tree work is better done
+# with the store's own loops over the columns, e.g. walk() and mainline().
+
+import collections.abc
+import weakref
+
+from array import array
+
+from gofish.constants import *
+from gofish.tree import *
+from gofish.utils import *
+
+colour_codes = {"B": 1, "W": 2}
+colour_keys = {1: "B", 2: "W"}
+
+
+def encode_move(key, value):            # Returns 0 if this can't be packed into the moves column
+
+    colour = colour_codes.get(key, 0)
+
+    if colour == 0:
+        return 0
+    if value == "":
+        return colour
+    if len(value) == 2 and "a" <= value[0] <= "z" and "a" <= value[1] <= "z":
+        return colour | (ord(value[0]) - 96) << 2 | (ord(value[1]) - 96) << 7
+
+    return 0
+
+
+def decode_move(code):                  # Returns (key, value), e.g. ("B", "pd"), or (None, None)
+
+    if code == 0:
+        return None, None
+
+    x = code >> 2 & 31
+    y = code >> 7 & 31
+
+    if x == 0:
+        return colour_keys[code & 3], ""
+
+    return colour_keys[code & 3], chr(x + 96) + chr(y + 96)
+
+
+class TreeStore():
+
+    def __init__(self):
+        self.parents = array("i")
+        self.first_children = array("i")
+        self.next_siblings = array("i")
+        self.moves = array("H")
+        self.moves_made = array("I")
+        self.main_line = bytearray()
+        self.extra = dict()                             # index --> dict of other properties
+        self.views = weakref.WeakValueDictionary()      # index --> StoreNode, for as long as anyone holds it
+        self.tree = TreeInfo()                          # Shared by the views, as by the nodes of a tree
+
+    def __len__(self):
+        return len(self.parents)
+
+    def add_node(self, parent = -1, properties = None):
+
+        # Add a node as the last child of parent (or as the root, if parent is -1) and return its index.
+
+        index = len(self.parents)
+
+        self.parents.append(parent)
+        self.first_children.append(-1)
+        self.next_siblings.append(-1)
+        self.moves.append(0)
+        self.moves_made.append(0)
+        self.main_line.append(0)
+
+        if parent < 0:
+            self.main_line[index] = 1
+        else:
+            child = self.first_children[parent]
+            if child < 0:
+                self.first_children[parent] = index
+                self.main_line[index] = self.main_line[parent]
+            else:
+                while self.next_siblings[child] >= 0:
+                    child = self.next_siblings[child]
+                self.next_siblings[child] = index
+
+        if properties:
+            for key, values in properties.items():
+                self.set_values(index, key, list(values))
+
+        moves = 0
+        for key in ["B", "W"]:
+            moves += len(self.get_values(index, key) or [])
+
+        self.moves_made[index] = moves if parent < 0 else self.moves_made[parent] + moves
+
+        return index
+
+    def add_tree(self, node, parent = -1, merge = False):
+
+        # Copy a tree of Nodes (e.g. as loaded from a file) into the store, under parent. If merge
+        # is set, a node whose move matches one of the existing children becomes that child,
+        # taking on any properties it lacks. Returns the index of the top node.
+
+        stack = [(node, parent)]
+        top = None
+
+        while stack:
+
+            node, parent = stack.pop()
+            index = -1
+
+            if merge and parent >= 0:
+                code = self.node_move_code(node)
+                if code:
+                    for child in self.children_of(parent):
+                        if self.moves[child] == code:
+                            index = child
+                            for key, values in node.properties.items():
+                                if self.get_values(child, key) is None:
+                                    self.set_values(child, key, list(values))
+                            break
+
+            if index < 0:
+                index = self.add_node(parent, node.properties)
+
+            if top is None:
+                top = index
+
+            for child in reversed(node.children):
+                stack.append((child, index))
+
+        return top
+
+    def node_move_code(self, node):             # The packed move of a Node, or 0 if it has none (or an odd one)
+        if "B" in node.properties and "W" in node.properties:
+            return 0
+        for key in ["B", "W"]:
+            if key in node.properties and len(node.properties[key]) == 1:
+                return encode_move(key, node.properties[key][0])
+        return 0
+
+    # Properties...
+
+    def get_values(self, index, key):           # The list of values, or None
+
+        move_key, move_value = decode_move(self.moves[index])
+
+        if key == move_key:
+            return [move_value]
+
+        extra = self.extra.get(index)
+        if extra is None:
+            return None
+
+        return extra.get(key)
+
+    def set_values(self, index, key, values):
+
+        extra = self.extra.get(index)
+        move_key, __ = decode_move(self.moves[index])
+
+        if key == move_key:
+            self.moves[index] = 0
+            move_key = None
+
+        if move_key is None and len(values) == 1 and (extra is None or key not in extra):
+            code = encode_move(key, values[0])
+            if code:
+                self.moves[index] = code
+                return
+
+        if extra is None:
+            extra = dict()
+            self.extra[index] = extra
+
+        extra[key] = values
+
+    def delete_values(self, index, key):
+
+        move_key, __ = decode_move(self.moves[index])
+
+        if key == move_key:
+            self.moves[index] = 0
+            return
+
+        extra = self.extra.get(index)
+        if extra is None:
+            raise KeyError(key)
+
+        del extra[key]
+        if len(extra) == 0:
+            del self.extra[index]
+
+    def keys(self, index):
+        move_key, __ = decode_move(self.moves[index])
+        if move_key is not None:
+            yield move_key
+        extra = self.extra.get(index)
+        if extra is not None:
+            yield from extra
+
+    def boardsize(self):
+        try:
+            return int(self.extra[0]["SZ"][0])
+        except (KeyError, IndexError, ValueError):
+            return 19
+
+    # Traversals, as plain loops over the columns...
+
+    def children_of(self, index):
+        ret = []
+        child = self.first_children[index]
+        while child >= 0:
+            ret.append(child)
+            child = self.next_siblings[child]
+        return ret
+
+    def walk(self, index = 0):                  # Yield the indices of the subtree, depth first, in file order
+
+        first_children = self.first_children
+        next_siblings = self.next_siblings
+
+        yield index
+
+        stack = [first_children[index]]         # Each entry is a node still to visit, followed by its later siblings
+        while stack:
+            index = stack.pop()
+            while index >= 0:
+                yield index
+                sibling = next_siblings[index]
+                if sibling >= 0:
+                    stack.append(sibling)
+                index = first_children[index]
+
+    def mainline(self, index = 0):              # Yield the indices of the (local) main line from here
+        first_children = self.first_children
+        while index >= 0:
+            yield index
+            index = first_children[index]
+
+    def dyer(self):
+
+        dyer = {20: "??", 40: "??", 60: "??", 31: "??", 51: "??", 71: "??"}
+        size = self.boardsize()
+
+        for index in self.mainline():
+            moves_made = self.moves_made[index]
+            if moves_made in dyer:
+                code = self.moves[index]
+                x = code >> 2 & 31
+                y = code >> 7 & 31
+                if 1 <= x <= size and 1 <= y <= size:
+                    dyer[moves_made] = string_from_point(x, y)
+            if moves_made > 71:
+                break
+
+        return dyer[20] + dyer[40] + dyer[60] + dyer[31] + dyer[51] + dyer[71]
+
+    # Views...
+
+    def node(self, index):
+        view = self.views.get(index)
+        if view is None:
+            view = StoreNode(self, index)
+            self.views[index] = view
+        return view
+
+    def root(self):
+        return self.node(0)
+
+
+class StoreProperties(collections.abc.MutableMapping):
+
+    # What a StoreNode has as its .properties - reads and writes go to the store. Note that
+    # only lists in the side table can be changed in place; use set_value() / add_value().
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        values = self.store.get_values(self.index, key)
+        if values is None:
+            raise KeyError(key)
+        return values
+
+    def __setitem__(self, key, values):
+        self.store.set_values(self.index, key, values)
+
+    def __delitem__(self, key):
+        self.store.delete_values(self.index, key)
+
+    def __iter__(self):
+        return iter(list(self.store.keys(self.index)))      # A copy, so keys can be deleted while iterating
+
+    def __len__(self):
+        return len(list(self.store.keys(self.index)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class StoreNode(Node):
+
+    # A view of one node of a TreeStore. Views are made on demand and shared while anything
+    # holds them, so comparing nodes with "is" still works. The board cache holds boards
+    # against the view, so they go when it does.
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.move_cache = None
+        self.child_index = None
+
+    @property
+    def properties(self):
+        return StoreProperties(self.store, self.index)
+
+    @properties.setter
+    def properties(self, properties):
+        for key in list(self.properties):
+            self.store.delete_values(self.index, key)
+        for key, values in properties.items():
+            self.store.set_values(self.index, key, list(values))
+
+    @property
+    def children(self):
+        return [self.store.node(child) for child in self.store.children_of(self.index)]
+
+    @property
+    def tree(self):
+        return self.store.tree
+
+    @property
+    def parent(self):
+        parent = self.store.parents[self.index]
+        if parent < 0:
+            return None
+        return self.store.node(parent)
+
+    @property
+    def moves_made(self):
+        return self.store.moves_made[self.index]
+
+    @moves_made.setter
+    def moves_made(self, moves_made):
+        self.store.moves_made[self.index] = moves_made
+
+    @property
+    def is_main_line(self):
+        return bool(self.store.main_line[self.index])
+
+    @is_main_line.setter
+    def is_main_line(self, is_main_line):
+        self.store.main_line[self.index] = 1 if is_main_line else 0
+
+    def new_child(self, append = True):
+        if append:
+            return self.store.node(self.store.add_node(self.index))
+        else:
+            return Node(parent = None)             # e.g. the test child in make_move(), which needn't be stored
+
+    def remove_child(self, child):          # Nodes are never removed from a TreeStore
+        raise WrongNode
+
+    def add_value(self, key, value):        # Node's version would append to a list that might not be kept
+        key = key.strip()
+        values = self.store.get_values(self.index, key)
+        if values is None:
+            Node.add_value(self, key, value)
+        elif str(value) not in values:
+            self.store.set_values(self.index, key, values + [str(value)])
+
+    def move_coords(self):                  # As Node.move_coords() but without needing the board
+        code = self.store.moves[self.index]
+        if code == 0:
+            return Node.move_coords(self)       # Perhaps there's an odd move in the side table
+        x = code >> 2 & 31
+        y = code >> 7 & 31
+        size = self.store.boardsize()
+        if 1 <= x <= size and 1 <= y <= size:
+            return (x, y)
+        return None
+
+    def boardsize(self):
+        return self.store.boardsize()
+
+    def dyer(self):
+        return self.store.dyer()
+
+    def unlink_recursive(self):             # Nothing to do, there are no references between nodes
+        pass
+
+
+def new_store(size):            # Like new_tree(), returns the root (a StoreNode) of a new TreeStore
+    if size > 19 or size < 1:
+        raise BadBoardSize
+
+    store = TreeStore()
+    store.add_node()
+
+    root = store.root()
+    root.board = Board(size)
+    root.set_value("FF", 4)
+    root.set_value("GM", 1)
+    root.set_value("CA", "UTF-8")
+    root.set_value("SZ", size)
+    return root
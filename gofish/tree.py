@@ -1,20 +1,110 @@
-import copy
+import collections, collections.abc, random, sys, weakref
+
+from array import array
 
 from gofish.constants import *
 from gofish.utils import *
 
 # ---------------------------------------------------------------------------
 
-class Board():                          # Internally the arrays are 1 too big, with 0 indexes being ignored (so we can use indexes 1 to 19)
+BORDER = 3                              # The contents of the points around the edge of a Board
+
+# Random numbers for Zobrist hashing: one per point index and colour (0 for EMPTY), as
+# zobrist_points[index * 3 + colour], plus one per board size, so empty boards differ.
+
+zobrist_random = random.Random(19)
+zobrist_points = [zobrist_random.getrandbits(64) if colour != EMPTY else 0 for index in range(21 * 21) for colour in range(3)]
+zobrist_sizes = [zobrist_random.getrandbits(64) for size in range(20)]
+zobrist_white_to_play = zobrist_random.getrandbits(64)        # Used for position keys (see Node.position_history)
+
+class Board():
+
+    # The points are kept in one flat bytearray of (boardsize + 2) squared, with a border of
+    # BORDER points all round; point x, y is at x * (boardsize + 2) + y, so the neighbours of
+    # point p are p - 1, p + 1, p - width and p + width, and copying a board is a single slice.
+    # The state attribute is a view of this in the old layout, boardsize + 1 rows of
+    # boardsize + 1, so board.state[x][y] still works (with indexes 1 to 19, as before) for
+    # both reading and writing. As before, the 0 indexes read as EMPTY and writes to them
+    # are ignored (see StateRow).
+    #
+    # push_node() and pop() apply and exactly revert a node's changes to the board, so one
+    # board can follow a walk around a tree without copying the cells (see walk_boards).
+    #
+    # The hash attribute is a Zobrist hash of the position, kept up to date as stones come
+    # and go.
+    #
+    # Groups are kept as chains, in four arrays indexed by point: heads (the point that
+    # stands for the stone's chain, 0 if no stone), links (the next stone in the chain, in a
+    # circle), and, for heads, sizes and libs. The libs count is of pseudo-liberties, i.e. a
+    # liberty touching 2 stones of the chain counts twice, which is easy to keep up to date
+    # and is 0 exactly when the chain has no liberties. So playing a move only touches the
+    # chains next to it (and relabels the smaller of any 2 it joins); captures and suicide
+    # need no searching. Copies share the arrays until one of them plays a move. They are
+    # only built when something asks about groups (liberties, group, groups, preview_move,
+    # and so Node.legal_moves), and are thrown away (to be built again) when setup stones
+    # are added. Until then, moves are played as before, by searching out the groups next to
+    # them, which is quicker than keeping chains up to date that nothing looks at.
+    #
+    # Writing to state directly bypasses both the hash and the chains; call rehash() afterwards.
+
+    __slots__ = ("boardsize", "width", "cells", "undo", "hash", "__rows", "__chains", "__shared")
+
     def __init__(self, boardsize):
         self.boardsize = boardsize
-        self.stones_checked = set()     # Used when searching for liberties
-        self.state = []
-        for x in range(self.boardsize + 1):
-            ls = list()
-            for y in range(self.boardsize + 1):
-                ls.append(0)
-            self.state.append(ls)
+        self.width = boardsize + 2
+        self.cells = bytearray([BORDER]) * (self.width * self.width)
+        for x in range(1, boardsize + 1):
+            start = x * self.width + 1
+            self.cells[start:start + boardsize] = bytes(boardsize)
+        self.undo = []                  # For each pushed node, the list of (index, old contents) it changed, and the old chains or chain entries
+        self.hash = zobrist_sizes[boardsize]
+        self.__rows = None
+        self.__chains = None
+        self.__shared = False
+
+    @property
+    def state(self):
+        if self.__rows is None:
+            self.__rows = [StateRow(self.cells, x * self.width, self.boardsize + 1) for x in range(self.boardsize + 1)]
+        return self.__rows
+
+    def colour_at(self, x, y):
+        return self.cells[x * self.width + y]
+
+    def as_array(self):
+
+        # A NumPy (boardsize, boardsize) int8 view of the board, indexed [x - 1, y - 1]; numpy
+        # must be installed. As with state, writing to it bypasses the hash and the chains.
+
+        import numpy
+        view = numpy.frombuffer(self.cells, dtype = numpy.int8).reshape(self.width, self.width)
+        return view[1:-1, 1:-1]
+
+    def copy(self):
+        board = Board.__new__(Board)
+        board.boardsize = self.boardsize
+        board.width = self.width
+        board.cells = self.cells[:]
+        board.undo = []
+        board.hash = self.hash
+        board.__rows = None
+        board.__chains = self.__chains
+        board.__shared = True
+        self.__shared = True
+        return board
+
+    def rehash(self):
+        self.hash = zobrist_sizes[self.boardsize]
+        for p, contents in enumerate(self.cells):
+            if contents != BORDER:
+                self.hash ^= zobrist_points[p * 3 + contents]
+        self.__chains = None
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __reduce__(self):                   # Only the cells are needed, the rest is remade
+        return (restore_board, (self.boardsize, bytes(self.cells)))
 
     def dump(self, highlight = None):
 
@@ -37,34 +127,132 @@ class Board():                          # Internally the arrays are 1 too big, w
 
                 if col == 0:                # Remember that the real board starts at 1
                     print(" ", end=end)
-                elif self.state[col][row] == EMPTY and is_star_point(col, row, self.boardsize):
+                elif self.colour_at(col, row) == EMPTY and is_star_point(col, row, self.boardsize):
                     print("+", end=end)
                 else:
-                    print(pieces[self.state[col][row]], end=end)
+                    print(pieces[self.colour_at(col, row)], end=end)
             print()
 
     def group_has_liberties(self, x, y):
         assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
-        self.stones_checked = set()
-        return self.__group_has_liberties(x, y)
+        assert(self.cells[x * self.width + y] in [BLACK, WHITE])
+        if self.__chains is None:
+            return self.__has_liberties(x * self.width + y)
+        heads, links, sizes, libs = self.__chains
+        return libs[heads[x * self.width + y]] > 0
+
+    def __has_liberties(self, p):           # Search out whether the group of the stone at p has a liberty, without the chains
+        cells = self.cells
+        width = self.width
+        if EMPTY in (cells[p - 1], cells[p + 1], cells[p - width], cells[p + width]):
+            return True                 # The usual case, so check it before setting up the search
+        colour = cells[p]
+        seen = {p}
+        stack = [p]
+        while stack:
+            p = stack.pop()
+            for q in (p - 1, p + 1, p - width, p + width):
+                contents = cells[q]
+                if contents == EMPTY:
+                    return True
+                if contents == colour and q not in seen:
+                    seen.add(q)
+                    stack.append(q)
+        return False
 
-    def __group_has_liberties(self, x, y):
+    def group(self, x, y):                  # The set of points (x, y) in the group at x, y (empty if there's no stone there)
         assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
-        colour = self.state[x][y]
-        assert(colour in [BLACK, WHITE])
+        if self.cells[x * self.width + y] == EMPTY:
+            return set()
+        return {divmod(p, self.width) for p in self.__stones(x * self.width + y)}
 
-        self.stones_checked.add((x,y))
+    def liberties(self, x, y):              # The set of points (x, y) that are liberties of the group at x, y
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        if self.cells[x * self.width + y] == EMPTY:
+            return set()
+        cells = self.cells
+        width = self.width
+        ret = set()
+        for p in self.__stones(x * width + y):
+            for q in (p - 1, p + 1, p - width, p + width):
+                if cells[q] == EMPTY:
+                    ret.add(divmod(q, width))
+        return ret
 
-        for i, j in adjacent_points(x, y, self.boardsize):
-            if self.state[i][j] == EMPTY:
-                return True
-            if self.state[i][j] == colour:
-                if (i,j) not in self.stones_checked:
-                    if self.__group_has_liberties(i, j):
-                        return True
-        return False
+    def groups(self):                       # Yield (points, liberties) for every group on the board, as sets of (x, y)
+        cells = self.cells
+        width = self.width
+        heads, links, sizes, libs = self.__get_chains()
+        for p, colour in enumerate(cells):
+            if heads[p] == p and (colour == BLACK or colour == WHITE):
+                stones = self.__stones(p)
+                liberties = {q for s in stones for q in (s - 1, s + 1, s - width, s + width) if cells[q] == EMPTY}
+                yield {divmod(s, width) for s in stones}, {divmod(q, width) for q in liberties}
+
+    def __stones(self, p):                  # The points of the chain of the stone at p
+        heads, links, sizes, libs = self.__get_chains()
+        ret = [p]
+        s = links[p]
+        while s != p:
+            ret.append(s)
+            s = links[s]
+        return ret
+
+    def __get_chains(self):
+        if self.__chains is None:
+            self.__chains = self.__build_chains()
+            self.__shared = False
+        return self.__chains
+
+    def __own_chains(self):                 # The chain arrays, for changing, so not shared with any other board
+        if self.__chains is None:
+            self.__chains = self.__build_chains()
+        elif self.__shared:
+            heads, links, sizes, libs = self.__chains
+            self.__chains = (heads[:], links[:], sizes[:], libs[:])
+        self.__shared = False
+        return self.__chains
+
+    def __build_chains(self):
+        empty = array("H", bytes(2 * len(self.cells)))
+        self.__chains = (empty, empty[:], empty[:], empty[:])
+        for p, colour in enumerate(self.cells):
+            if (colour == BLACK or colour == WHITE) and self.__chains[0][p] == 0:
+                self.__find_chain(p)
+        return self.__chains
+
+    def __find_chain(self, p):              # Search out the chain of the stone at p from scratch, and record it with p as its head
+        cells = self.cells
+        width = self.width
+        heads, links, sizes, libs = self.__chains
+        colour = cells[p]
+        head = p
+        heads[p] = head
+        links[p] = p
+        sizes[head] = 1
+        libs[head] = 0
+        stack = [p]
+        while stack:
+            p = stack.pop()
+            for q in (p - 1, p + 1, p - width, p + width):
+                contents = cells[q]
+                if contents == EMPTY:
+                    libs[head] += 1
+                elif contents == colour and heads[q] != head:
+                    heads[q] = head
+                    links[q] = links[head]
+                    links[head] = q
+                    sizes[head] += 1
+                    stack.append(q)
+
+    def play_move(self, colour, x, y):      # No legality checks, as per SGF standard. Returns the number of stones captured.
+        return self.__play_move(colour, x, y, None, None)
+
+    def __play_move(self, colour, x, y, changes, saved):
+
+        # If saved is a list, each chain entry is recorded in it, as (index, head, link, size, libs),
+        # before it's changed, so that pop() can put back just those.
 
-    def play_move(self, colour, x, y):      # No legality checks, as per SGF standard
         assert(colour in [BLACK, WHITE])
 
         opponent = BLACK if colour == WHITE else WHITE
@@ -72,34 +260,261 @@ class Board():                          # Internally the arrays are 1 too big, w
         if x < 1 or x > self.boardsize or y < 1 or y > self.boardsize:
             raise OffBoard
 
-        self.state[x][y] = colour
-
-        for i, j in adjacent_points(x, y, self.boardsize):
-            if self.state[i][j] == opponent:
-                if not self.group_has_liberties(i, j):
-                    self.destroy_group(i, j)
+        cells = self.cells
+        width = self.width
+        p = x * width + y
+
+        if self.__chains is None:           # No chains to keep up to date, so search for captures
+            if changes is not None:
+                changes.append((p, cells[p]))
+            self.hash ^= zobrist_points[p * 3 + cells[p]] ^ zobrist_points[p * 3 + colour]
+            cells[p] = colour
+            captures = 0
+            for q in (p - 1, p + 1, p - width, p + width):
+                if cells[q] == opponent and not self.__has_liberties(q):
+                    captures += self.__remove_group(q, changes)
+            if not self.__has_liberties(p):
+                self.__remove_group(p, changes)
+            return captures
+
+        heads, links, sizes, libs = self.__own_chains()
+
+        if cells[p] != EMPTY:               # Playing onto a stone (the SGF standard allows it), so lift it first
+            self.__lift_stone(p, changes, saved)
+
+        if changes is not None:
+            changes.append((p, EMPTY))
+        if saved is not None:
+            saved.append((p, heads[p], links[p], sizes[p], libs[p]))
+        self.hash ^= zobrist_points[p * 3 + colour]
+        cells[p] = colour
+
+        # The new stone takes a liberty from every chain it touches...
+
+        neighbours = (p - 1, p + 1, p - width, p + width)
+        liberties = 0
+
+        for q in neighbours:
+            contents = cells[q]
+            if contents == EMPTY:
+                liberties += 1
+            elif contents != BORDER:
+                head = heads[q]
+                if saved is not None:
+                    saved.append((head, head, links[head], sizes[head], libs[head]))
+                libs[head] -= 1
+
+        # ...and joins the chain of a friendly neighbour, or starts one of its own. Any other
+        # friendly chains it touches are then joined on, relabelling the smaller of each pair...
+
+        head = 0
+
+        for q in neighbours:
+            if cells[q] == colour:
+                b = heads[q]
+                if head == 0:
+                    head = b
+                    heads[p] = head
+                    links[p] = links[head]
+                    links[head] = p
+                    sizes[head] += 1
+                    libs[head] += liberties
+                elif b != head:
+                    a = head
+                    if sizes[a] < sizes[b]:
+                        a, b = b, a
+                    if saved is not None:
+                        saved.extend((s, heads[s], links[s], sizes[s], libs[s]) for s in self.__stones(b))
+                    s = b
+                    while True:
+                        heads[s] = a
+                        s = links[s]
+                        if s == b:
+                            break
+                    links[a], links[b] = links[b], links[a]
+                    sizes[a] += sizes[b]
+                    libs[a] += libs[b]
+                    head = a
+
+        if head == 0:
+            heads[p] = p
+            links[p] = p
+            sizes[p] = 1
+            libs[p] = liberties
+
+        # ...then enemy chains with no liberties left are captured.
+
+        captures = 0
+
+        for q in neighbours:
+            if cells[q] == opponent and libs[heads[q]] == 0:
+                captures += self.__remove_chain(q, changes, saved)
 
         # Check for and deal with suicide:
 
-        if not self.group_has_liberties(x, y):
-            self.destroy_group(x, y)
+        if libs[heads[p]] == 0:
+            self.__remove_chain(p, changes, saved)
+
+        return captures
+
+    def preview_move(self, colour, x, y):
+
+        # Return (captures, hash) as they would be after play_move(colour, x, y), or None if
+        # the move would be suicide, without changing the board. The point must be empty.
+        # A chain has only the liberty p if all its pseudo-liberties are stones touching p.
 
-    def destroy_group(self, x, y):
-        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
-        colour = self.state[x][y]
         assert(colour in [BLACK, WHITE])
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+
+        cells = self.cells
+        width = self.width
+        p = x * width + y
+        assert(cells[p] == EMPTY)
 
-        self.state[x][y] = EMPTY
+        heads, links, sizes, libs = self.__get_chains()
+        neighbours = (p - 1, p + 1, p - width, p + width)
+        opponent = BLACK if colour == WHITE else WHITE
 
-        for i, j in adjacent_points(x, y, self.boardsize):
-            if self.state[i][j] == colour:
-                self.destroy_group(i, j)
+        board_hash = self.hash ^ zobrist_points[p * 3 + colour]
+        captures = 0
+        breathes = False
+        done = []
+
+        for q in neighbours:
+            contents = cells[q]
+            if contents == EMPTY:
+                breathes = True
+            elif contents == colour or contents == opponent:
+                head = heads[q]
+                if head in done:
+                    continue
+                done.append(head)
+                only_p = libs[head] <= 4 and libs[head] == sum(1 for r in neighbours if heads[r] == head)
+                if contents == colour and not only_p:
+                    breathes = True
+                elif contents == opponent and only_p:
+                    for s in self.__stones(head):
+                        board_hash ^= zobrist_points[s * 3 + opponent]
+                        captures += 1
+
+        if captures == 0 and not breathes:
+            return None
 
-    def update_from_node(self, node):
+        return captures, board_hash
+
+    def destroy_group(self, x, y):
+        assert(x >= 1 and x <= self.boardsize and y >= 1 and y <= self.boardsize)
+        assert(self.cells[x * self.width + y] in [BLACK, WHITE])
+        if self.__chains is None:
+            self.__remove_group(x * self.width + y, None)
+        else:
+            self.__own_chains()
+            self.__remove_chain(x * self.width + y, None, None)
+
+    def __remove_group(self, p, changes):   # Remove the group of the stone at p, searching it out, when there are no chains
+        cells = self.cells
+        width = self.width
+        colour = cells[p]
+        cells[p] = EMPTY
+        stack = [p]
+        removed = 0
+        while stack:
+            p = stack.pop()
+            if changes is not None:
+                changes.append((p, colour))
+            self.hash ^= zobrist_points[p * 3 + colour]
+            removed += 1
+            for q in (p - 1, p + 1, p - width, p + width):
+                if cells[q] == colour:
+                    cells[q] = EMPTY
+                    stack.append(q)
+        return removed
+
+    def __remove_chain(self, p, changes, saved):    # Remove the chain of the stone at p. Returns the number of stones removed
+        cells = self.cells
+        width = self.width
+        heads, links, sizes, libs = self.__chains
+        colour = cells[p]
+        stones = self.__stones(p)
+        if saved is not None:
+            saved.extend((s, heads[s], links[s], sizes[s], libs[s]) for s in stones)
+        for s in stones:
+            if changes is not None:
+                changes.append((s, colour))
+            self.hash ^= zobrist_points[s * 3 + colour]
+            cells[s] = EMPTY
+            heads[s] = 0
+        for s in stones:                    # Every stone touching the chain gets a liberty back
+            for q in (s - 1, s + 1, s - width, s + width):
+                contents = cells[q]
+                if contents != EMPTY and contents != BORDER:
+                    head = heads[q]
+                    if saved is not None:
+                        saved.append((head, head, links[head], sizes[head], libs[head]))
+                    libs[head] += 1
+        return len(stones)
+
+    def __lift_stone(self, p, changes, saved):      # Remove the single stone at p, which may split its chain
+        cells = self.cells
+        width = self.width
+        heads, links, sizes, libs = self.__chains
+        colour = cells[p]
+        head = heads[p]
+        neighbours = (p - 1, p + 1, p - width, p + width)
+        friends = [q for q in neighbours if cells[q] == colour]
+
+        if saved is not None:               # Only the chain's own stones, and the heads of enemies next to p, are changed
+            saved.extend((s, heads[s], links[s], sizes[s], libs[s]) for s in self.__stones(p))
+            for q in neighbours:
+                if cells[q] != EMPTY and cells[q] != BORDER and cells[q] != colour:
+                    saved.append((heads[q], heads[q], links[heads[q]], sizes[heads[q]], libs[heads[q]]))
+
+        if changes is not None:
+            changes.append((p, colour))
+        self.hash ^= zobrist_points[p * 3 + colour]
+        cells[p] = EMPTY
+        heads[p] = 0
+
+        if len(friends) == 1:               # The rest of the chain stays in one piece, so just unlink p from it
+            s = p
+            while links[s] != p:
+                s = links[s]
+            links[s] = links[p]
+            if head == p:
+                head = links[p]
+                sizes[head] = sizes[p]
+                libs[head] = libs[p]
+                while heads[s] != head:
+                    heads[s] = head
+                    s = links[s]
+            sizes[head] -= 1
+            libs[head] += 1 - sum(1 for q in neighbours if cells[q] == EMPTY)
+        elif len(friends) > 1:              # Whatever is left of the chain is found again, perhaps in pieces
+            rest = []
+            s = links[p]
+            while s != p:
+                rest.append(s)
+                heads[s] = 0
+                s = links[s]
+            for s in rest:
+                if heads[s] == 0:
+                    self.__find_chain(s)
+
+        for q in neighbours:
+            contents = cells[q]
+            if contents != EMPTY and contents != BORDER and contents != colour:
+                libs[heads[q]] += 1
+
+    def update_from_node(self, node, changes = None):
 
         # Use the node's properties to modify the board. For various reasons, this
         # might actually be used on a board that's already been so modified, but
-        # that should be completely harmless.
+        # that should be completely harmless. If changes is a list, every point
+        # altered is recorded in it as (index, old contents).
+
+        self.__update_from_node(node, changes, None)
+
+    def __update_from_node(self, node, changes, saved):     # As above; saved is as for __play_move()
 
         # A node can have all of "AB", "AW" and "AE" (but should not also have "B" or "W",
         # although that might occur in earlier (pre-4) format files. Note that adding a
@@ -112,8 +527,12 @@ class Board():                          # Internally the arrays are 1 too big, w
             if adder in node.properties:
                 for value in node.properties[adder]:
                     for point in points_from_points_string(value, self.boardsize):    # only returns points inside the board boundaries
-                        x, y = point[0], point[1]
-                        self.state[x][y] = adders[adder]
+                        p = point[0] * self.width + point[1]
+                        if changes is not None:
+                            changes.append((p, self.cells[p]))
+                        self.hash ^= zobrist_points[p * 3 + self.cells[p]] ^ zobrist_points[p * 3 + adders[adder]]
+                        self.cells[p] = adders[adder]
+                        self.__chains = None
 
         # A node "should" have only 1 of "B" or "W", and only 1 value in the list.
         # The result will be wrong if the specs are violated. Whatever.
@@ -126,33 +545,458 @@ class Board():                          # Internally the arrays are 1 too big, w
                 try:
                     x = ord(movestring[0]) - 96
                     y = ord(movestring[1]) - 96
-                    self.play_move(movers[mover], x, y)
+                    self.__play_move(movers[mover], x, y, changes, saved)
                 except (IndexError, OffBoard):
                     pass
 
+    def push_node(self, node):
+
+        # Without chains, only the cells (and hash) need putting back. A move's changes to the
+        # chains are undone by putting back the entries it changed. Setup stones throw the chains
+        # away (to be built again), so then the old ones are kept instead.
+
+        changes = []
+        chains = self.__chains
+        properties = node.properties
+        if chains is None:
+            self.__update_from_node(node, changes, None)
+            self.undo.append((changes, None, None))
+        elif "AB" in properties or "AW" in properties or "AE" in properties:
+            self.__shared = True            # So that any changes are made to a copy
+            self.__update_from_node(node, changes, None)
+            self.undo.append((changes, chains, None))
+        else:
+            saved = []
+            self.__update_from_node(node, changes, saved)
+            self.undo.append((changes, None, saved))
+
+    def pop(self):                          # Revert the most recent push_node()
+        cells = self.cells
+        changes, chains, saved = self.undo.pop()
+        for p, contents in reversed(changes):
+            self.hash ^= zobrist_points[p * 3 + cells[p]] ^ zobrist_points[p * 3 + contents]
+            cells[p] = contents
+        if saved is None:                   # The chains as they were (None if there were none)
+            self.__chains = chains
+            self.__shared = True
+        elif saved and self.__chains is not None:
+            heads, links, sizes, libs = self.__own_chains()
+            for p, head, link, size, lib in reversed(saved):
+                heads[p] = head
+                links[p] = link
+                sizes[p] = size
+                libs[p] = lib
+
+
+class StateRow(collections.abc.Sequence):
+
+    # One row of Board.state, i.e. row[y] is point x, y. It reads and writes the board's cells,
+    # but looks like the list it used to be: the border reads as EMPTY (0), and writes to it are
+    # ignored, as writes to the unused 0 indexes were.
+
+    __slots__ = ("cells", "start", "length")
+
+    def __init__(self, cells, start, length):
+        self.cells = cells
+        self.start = start
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, y):
+        if isinstance(y, slice):
+            return [self[i] for i in range(*y.indices(self.length))]
+        if y < 0:
+            y += self.length
+        if y < 0 or y >= self.length:
+            raise IndexError("StateRow index out of range")
+        contents = self.cells[self.start + y]
+        return EMPTY if contents == BORDER else contents
+
+    def __setitem__(self, y, colour):
+        if y < 0:
+            y += self.length
+        if y < 0 or y >= self.length:
+            raise IndexError("StateRow index out of range")
+        if self.cells[self.start + y] != BORDER:
+            self.cells[self.start + y] = colour
+
+    def __eq__(self, other):
+        if isinstance(other, (StateRow, list)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def restore_board(boardsize, cells):
+    board = Board(boardsize)
+    board.cells[:] = cells
+    board.rehash()
+    return board
+
+
+def position_key(board_hash, last_colour_played):     # The hash plus who is to play, see Node.position_history()
+    if last_colour_played == BLACK:
+        return board_hash ^ zobrist_white_to_play
+    return board_hash
+
+# ---------------------------------------------------------------------------
+
+class BoardCache():
+
+    # Boards for the most recently used nodes. Once there are more than max_size, the least
+    # recently used are thrown away (any board can be rebuilt from the root's properties and
+    # the moves leading to the node). Nodes are only weakly referenced, so the cache never
+    # keeps a tree alive. A max_size of 0 means boards are rebuilt every time.
+    #
+    # Separately, when a board is built, copies are kept of the boards at every node along the
+    # way whose depth is a multiple of checkpoint_interval (up to max_checkpoints of them, also
+    # least recently used first out). So building any board needs at most that many replays,
+    # once the checkpoints above it exist. A checkpoint_interval of 0 means no checkpoints.
+    # Boards are kept with the depth of their node, if known, so a build can count depths
+    # from the board it starts from (see Node.build_board).
+    #
+    # Finally, a few nodes have their position history (see Node.position_history) kept, for
+    # superko checks. A history is handed on from a node to its new child, so playing a game
+    # out move by move never needs it rebuilding.
+
+    def __init__(self, max_size = 1024, checkpoint_interval = 16, max_checkpoints = 1024, max_histories = 16):
+        self.max_size = max_size
+        self.checkpoint_interval = checkpoint_interval
+        self.max_checkpoints = max_checkpoints
+        self.max_histories = max_histories
+        self.entries = collections.OrderedDict()        # id(node) --> (weakref to node, [board, depth or None])
+        self.checkpoints = collections.OrderedDict()    # Likewise
+        self.histories = collections.OrderedDict()      # id(node) --> (weakref to node, set of position keys)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, node):            # Return the node's board or None, counting as a use of it
+        board = self.peek(node)
+        if board is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return board
+
+    def peek(self, node):           # Like get() but not counted in the stats
+        entry = self.peek_entry(node)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def peek_entry(self, node):     # Like peek() but return [board, depth], or None; the depth can be set if it was None
+        key = id(node)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0]() is node:
+            self.entries.move_to_end(key)
+            return entry[1]
+        entry = self.checkpoints.get(key)
+        if entry is not None and entry[0]() is node:
+            self.checkpoints.move_to_end(key)
+            return entry[1]
+        return None
+
+    def put(self, node, board, checkpoint = False, depth = None):
+        if checkpoint:
+            self.store(self.checkpoints, self.max_checkpoints, node, [board, depth])
+        else:
+            self.store(self.entries, self.max_size, node, [board, depth])
+
+    def get_history(self, node):
+        entry = self.histories.get(id(node))
+        if entry is not None and entry[0]() is node:
+            self.histories.move_to_end(id(node))
+            return entry[1]
+        return None
+
+    def take_history(self, node):   # Like get_history() but removes it, e.g. so it can be extended for a child
+        history = self.get_history(node)
+        if history is not None:
+            del self.histories[id(node)]
+        return history
+
+    def put_history(self, node, history):
+        self.store(self.histories, self.max_histories, node, history)
+
+    def store(self, table, limit, node, value):
+        if limit < 1:
+            return
+        key = id(node)
+        table[key] = (weakref.ref(node, lambda ref: self.forget(key, ref)), value)
+        table.move_to_end(key)
+        while len(table) > limit:
+            table.popitem(last = False)
+            self.evictions += 1
+
+    def forget(self, key, ref):     # Called when a node dies
+        for table in [self.entries, self.checkpoints, self.histories]:
+            entry = table.get(key)
+            if entry is not None and entry[0] is ref:
+                del table[key]
+
+    def discard(self, node):
+        for table in [self.entries, self.checkpoints, self.histories]:
+            entry = table.get(id(node))
+            if entry is not None and entry[0]() is node:
+                del table[id(node)]
+
+    def invalidate(self, node):
+
+        # Throw away the boards of the node and all its descendants, e.g. after its properties
+        # have changed. The descendants are found by going up from each cached node.
+
+        self.discard(node)
+
+        if len(self.entries) + len(self.checkpoints) + len(self.histories) == 0 or len(node.parsed_children()) == 0:
+            return
+
+        for table in [self.entries, self.checkpoints, self.histories]:
+            for key, (ref, value) in self.snapshot(table):
+                other = ref()
+                while other is not None:
+                    other = other.parent
+                    if other is node:
+                        table.pop(key, None)
+                        break
+
+    def snapshot(self, table):
+
+        # A list of the table's items. The garbage collector can run forget() (and so change
+        # the table) during any allocation, including while the list is being made.
+
+        while True:
+            try:
+                return list(table.items())
+            except RuntimeError:
+                pass
+
+    def resize(self, max_size, max_checkpoints = None):
+        self.max_size = max_size
+        if max_checkpoints is not None:
+            self.max_checkpoints = max_checkpoints
+        for table, limit in [(self.entries, self.max_size), (self.checkpoints, self.max_checkpoints)]:
+            while len(table) > max(limit, 0):
+                table.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.checkpoints.clear()
+        self.histories.clear()
+
+    def stats(self):
+        return {"size": len(self.entries), "max_size": self.max_size,
+                "checkpoints": len(self.checkpoints), "max_checkpoints": self.max_checkpoints,
+                "checkpoint_interval": self.checkpoint_interval,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+board_cache = BoardCache()
+
+board_keys = ["B", "W", "AB", "AW", "AE", "SZ"]       # Properties that affect the board
+
+board_classes = weakref.WeakKeyDictionary()         # root --> the class of board its tree uses, if not Board
+
+weak_roots = weakref.WeakSet()                      # Roots of trees whose nodes hold their parents weakly, see set_weak_parents()
+
+child_index_min = 8                                 # Nodes with fewer children than this just search them, see Node.child_for_move()
+
+
+def set_board_class(root, board_class):     # e.g. BitBoard (see bitboard.py); boards already made are thrown away
+    if board_class is Board:
+        board_classes.pop(root, None)
+    else:
+        board_classes[root] = board_class
+    board_cache.invalidate(root)
+
+
+def set_weak_parents(root, weak = True):
+
+    # In such a tree, each node's link to its parent is a weakref, so there are no reference
+    # cycles, and the whole tree is freed as soon as nothing holds the root (no need for
+    # unlink_recursive() or the garbage collector). Anything that keeps a node must keep the
+    # root too; asking for the parent of a node whose tree has gone raises ReferenceError.
+
+    if weak:
+        weak_roots.add(root)
+    else:
+        weak_roots.discard(root)
+
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        for child in node.parsed_children():        # Unparsed variations get the right links when parsed
+            child.parent = node
+            stack.append(child)
+
 # ---------------------------------------------------------------------------
 
+class TreeInfo():
+
+    # What the nodes of a tree share, held by every node so it's found without going up to
+    # the root: the board size from the root's SZ, once worked out, and a version which goes
+    # up whenever that size may have changed, making the moves cached in the tree stale.
+
+    __slots__ = ("size", "version")
+
+    def __init__(self):
+        self.size = None
+        self.version = 0
+
+
 class Node():
+
+    # Slots rather than a per-instance __dict__, since big trees have a great many nodes.
+    # Boards are not kept on the nodes, but in board_cache.
+    #
+    # move_cache holds (tree version, move_coords(), move_was_pass()) once worked out, so
+    # looking at moves needs neither a board nor, after the first time, the board size.
+    #
+    # tree is the TreeInfo of the tree the node was made in, or was last attached to as a
+    # child (by setting its parent, which gives all the nodes below it the same TreeInfo).
+    #
+    # The parent is kept in __parent, as a weakref if the tree was set up that way (see
+    # set_weak_parents), which is why parent is a property.
+    #
+    # child_index holds (tree version, number of children indexed, dict of (colour, point) -->
+    # first child with that move, point None for a pass, set of the children indexed), for nodes
+    # with many children. Children appended since are indexed when next needed; removing one
+    # should be via remove_child().
+
+    __slots__ = ("properties", "children", "moves_made", "is_main_line", "__parent", "tree", "move_cache", "child_index", "__weakref__")
+
     def __init__(self, parent):
         self.properties = dict()
         self.children = []
-        self.__board = None
         self.moves_made = 0
         self.is_main_line = False
+        self.tree = None
         self.parent = parent
+        self.move_cache = None
+        self.child_index = None
 
         if parent:
             parent.children.append(self)
 
+    @property
+    def parent(self):
+        parent = self.__parent
+        if parent.__class__ is weakref.ref:
+            parent = parent()
+            if parent is None:
+                raise ReferenceError("the node's tree has been freed; keep hold of its root")
+        return parent
+
+    @parent.setter
+    def parent(self, parent):
+        if parent is not None and parent.__holds_parent_weakly():
+            self.__parent = weakref.ref(parent)
+        else:
+            self.__parent = parent
+        if parent is not None:
+            if self.tree is None:           # A new node
+                self.tree = parent.tree
+            elif parent.tree is not self.tree:
+                self.__join_tree(parent.tree)
+        elif self.tree is None:
+            self.tree = TreeInfo()
+
+    def __join_tree(self, tree):
+
+        # The node is being attached to another tree, so it and all below it take that tree's
+        # TreeInfo, and throw away what they cached under the old one, including their boards
+        # (the board size and the root's setup may differ). Unparsed variations are left alone,
+        # they get the right TreeInfo when parsed.
+
+        for node in walk(self, parsed_only = True):
+            node.tree = tree
+            node.move_cache = None
+            node.child_index = None
+            board_cache.discard(node)
+
+    def __holds_parent_weakly(self):        # Also true of the root of a tree with weak parents, so its children do
+        parent = self.__parent
+        return parent.__class__ is weakref.ref or (parent is None and self in weak_roots)
+
     @property
     def board(self):
-        if not self.__board:
-            self.__board = self.build_board()
-        return self.__board
+        board = board_cache.get(self)
+        if board is None:
+            board, depth = self.__build_board()
+            board_cache.put(self, board, depth = depth)
+        return board
 
     @board.setter
     def board(self, board):
-        self.__board = board
+        if board is None:
+            board_cache.discard(self)
+        else:
+            board_cache.put(self, board)
+
+    def invalidate_board(self):     # Needed after changing board-related properties other than via set_value() etc
+        board_cache.invalidate(self)
+        self.move_cache = None
+        parent = self.parent
+        if parent is None:
+            tree = self.tree
+            if tree.size is not None:
+                tree.size = None
+                tree.version += 1
+        elif parent.child_index is not None and self in parent.child_index[3]:
+            parent.child_index = None       # Our move may have changed, and we were already indexed
+
+    def boardsize(self):            # The size from the root's SZ, kept for the tree (see TreeInfo), so no board is needed
+        tree = self.tree
+        if tree.size is None:
+            root = self.get_root_node()
+            try:
+                tree.size = int(root.properties["SZ"][0])
+            except (KeyError, IndexError, ValueError):
+                tree.size = 19
+        return tree.size
+
+    def position_hash(self):        # A Zobrist hash of the stones on the board (not who is to play), usable as a dict key
+        return self.board.hash
+
+    def position_history(self):
+
+        # Return the set of position keys of this node and all its ancestors, where the key
+        # of a position is its hash, XORed with zobrist_white_to_play if Black played last.
+        # The set belongs to the board cache; don't change it.
+
+        history = board_cache.get_history(self)
+        if history is not None:
+            return history
+
+        history = set()
+        board = None
+
+        for node in self.node_path():
+            if board is None:
+                board = node.board.copy()
+            else:
+                board.update_from_node(node)
+            history.add(position_key(board.hash, node.last_colour_played()))
+
+        board_cache.put_history(self, history)
+        return history
+
+    def __hand_on_history(self, child):       # If we have a history, give it (extended) to the new child
+
+        history = board_cache.take_history(self)
+        if history is not None:
+            history.add(position_key(child.board.hash, child.last_colour_played()))
+            board_cache.put_history(child, history)
 
     def moves_in_this_node(self):
         ret = 0
@@ -169,21 +1013,11 @@ class Node():
         else:
             self.moves_made = self.moves_in_this_node()
 
-    def update_recursive(self, update_board = True):    # Only goes recursive if 2 or more children
-        node = self
-        while 1:
+    def update_recursive(self, update_board = True):      # Unparsed variations are set up when parsed
+        for node in walk(self, parsed_only = True):
+            if node is not self:
+                node.parent.copy_state_to_child(node, copy_board = update_board)
             node.update(update_board)
-            if len(node.children) == 0:
-                return
-            elif len(node.children) == 1:               # i.e. just iterate where possible
-                node.copy_state_to_child(node.children[0], copy_board = update_board)
-                node = node.children[0]
-                continue
-            else:
-                for child in node.children:
-                    node.copy_state_to_child(child, copy_board = update_board)
-                    child.update_recursive(update_board)
-                return
 
     def fix_main_line_status(self):
         if self.parent is None or (self.parent.is_main_line and self is self.parent.children[0]):
@@ -191,19 +1025,9 @@ class Node():
         else:
             self.is_main_line = False
 
-    def fix_main_line_status_recursive(self):       # Only goes recursive if 2 or more children
-        node = self
-        while 1:
+    def fix_main_line_status_recursive(self):
+        for node in walk(self, parsed_only = True):
             node.fix_main_line_status()
-            if len(node.children) == 0:
-                return
-            elif len(node.children) == 1:           # i.e. just iterate where possible
-                node = node.children[0]
-                continue
-            else:
-                for child in node.children:
-                    child.fix_main_line_status_recursive()
-                return
 
     def copy_state_to_child(self, child, copy_board = True):
 
@@ -215,7 +1039,7 @@ class Node():
                     child.is_main_line = True
 
         if copy_board:
-            child.board = copy.deepcopy(self.board)     # not needed when loading a file; the board is generated the first time it's needed
+            child.board = self.board.copy()             # not needed when loading a file; the board is generated the first time it's needed
 
         child.moves_made = self.moves_made
 
@@ -266,32 +1090,40 @@ class Node():
         return s
 
     def move_coords(self):          # Assumes one move at most, which the specs also insist on. A pass causes None to be returned.
-        for key in ["B", "W"]:
-            if key in self.properties:
-                movestring = self.properties[key][0]
-                try:
-                    x = ord(movestring[0]) - 96
-                    y = ord(movestring[1]) - 96
-                    if 1 <= x <= self.board.boardsize and 1 <= y <= self.board.boardsize:
-                        return (x, y)
-                except IndexError:
-                    pass
-        return None
+        if self.move_cache is None or self.move_cache[0] != self.tree.version:
+            self.move_cache = self.__parse_move()
+        return self.move_cache[1]
 
     def what_was_the_move(self):    # Rather lame name I chose at the start
         return self.move_coords()
 
     def move_was_pass(self):
-        for key in ["B", "W"]:
-            if key in self.properties:
-                movestring = self.properties[key][0]
-                if len(movestring) < 2:                     # e.g. W[]
-                    return True
-                x = ord(movestring[0]) - 96
-                y = ord(movestring[1]) - 96
-                if x < 1 or x > self.board.boardsize or y < 1 or y > self.board.boardsize:      # e.g. W[tt]
-                    return True
-        return False
+        if self.move_cache is None or self.move_cache[0] != self.tree.version:
+            self.move_cache = self.__parse_move()
+        return self.move_cache[2]
+
+    def __parse_move(self):         # (tree version, the first move on the board, whether any move is a pass)
+
+        coords = None
+        was_pass = False
+
+        if "B" in self.properties or "W" in self.properties:
+            size = self.boardsize()
+            for key in ["B", "W"]:
+                if key in self.properties:
+                    movestring = self.properties[key][0]
+                    if len(movestring) < 2:                 # e.g. W[]
+                        was_pass = True
+                        continue
+                    x = ord(movestring[0]) - 96
+                    y = ord(movestring[1]) - 96
+                    if 1 <= x <= size and 1 <= y <= size:
+                        if coords is None:
+                            coords = (x, y)
+                    else:                                   # e.g. W[tt]
+                        was_pass = True
+
+        return (self.tree.version, coords, was_pass)
 
     def siblings(self):
         if self.parent is None:
@@ -329,6 +1161,12 @@ class Node():
             return None
         return self.children[0].move_coords()
 
+    def unparsed_variations(self):  # Overridden by lazily loaded nodes, see sgf.py
+        return None
+
+    def parsed_children(self):      # The children, without parsing any unparsed variations (see sgf.py)
+        return self.children
+
     def children_moves(self):
         moves = set()
         for node in self.children:
@@ -348,34 +1186,43 @@ class Node():
 
     def get_root_node(self):        # Iterate up to the root and return it
         node = self
-        while 1:
-            if node.parent:
-                node = node.parent
-            else:
-                break
+        parent = node.parent
+        while parent is not None:
+            node = parent
+            parent = node.parent
         return node
 
     def add_value(self, key, value):        # Note that, if improperly used, could lead to odd nodes like ;B[ab][cd]
         value = str(value)
-        key = key.strip()
+        key = sys.intern(key.strip())
         if key == "":
             raise KeyError
         if value == "" and key not in ["B", "W"]:
             return                          # Ignore empty strings, except for passes
+        if len(value) <= 2:
+            value = sys.intern(value)       # Points like "pd" turn up in most nodes, so share them
         if key not in self.properties:
-            self.properties[key] = []
-        if value not in self.properties[key]:
+            self.properties[key] = [value]
+        elif value not in self.properties[key]:
             self.properties[key].append(value)
+        else:
+            return
+        if key in board_keys:
+            self.invalidate_board()
 
     def set_value(self, key, value):        # Like the above, but only allows the node to have 1 value for this key
         value = str(value)
-        key = key.strip()
+        key = sys.intern(key.strip())
         if key == "":
             raise KeyError
+        if len(value) <= 2:
+            value = sys.intern(value)
         if value == "" and key not in ["B", "W"]:
             self.properties.pop(key, None)  # Destroy the key if the value is empty string (except passes)
         else:
             self.properties[key] = [value]
+        if key in board_keys:
+            self.invalidate_board()
 
     def safe_commit(self, key, value):      # This used to be different but now is just an alias
         self.set_value(key, value)
@@ -428,9 +1275,9 @@ class Node():
                 return BLACK
             if "AW" in node.properties and "AB" not in node.properties:
                 return WHITE
-            if node.parent == None:
-                return None
             node = node.parent
+            if node is None:
+                return None
 
     def move_colour(self):
         if "B" in self.properties:
@@ -440,39 +1287,47 @@ class Node():
         else:
             return None
 
-    def make_empty_child(self, append = True):      # Make child with no properties. Still gets the board though.
+    def new_child(self, append = True):             # Just the bare node; overridden by nodes that live elsewhere, see store.py
         if append:
-            child = Node(parent = self)             # This automatically appends the child to this node
+            return Node(parent = self)              # This automatically appends the child to this node
         else:
-            child = Node(parent = None)
+            return Node(parent = None)
 
+    def make_empty_child(self, append = True):      # Make child with no properties. Still gets the board though.
+        child = self.new_child(append)
         self.copy_state_to_child(child)
         return child
 
-    def __make_child_from_move(self, colour, x, y, append = True):
+    def __make_child_from_move(self, colour, x, y, board = None):     # board, if given, must already have the move played
         assert(colour in [BLACK, WHITE])
 
         if x < 1 or x > self.board.boardsize or y < 1 or y > self.board.boardsize:
             raise OffBoard
 
-        if append:
-            child = Node(parent = self)             # This automatically appends the child to this node
-        else:
-            child = Node(parent = None)
-
-        self.copy_state_to_child(child)
+        child = self.new_child()
 
         key = "W" if colour == WHITE else "B"
         child.set_value(key, string_from_point(x, y))
-        child.update()
+
+        if board is None:
+            self.copy_state_to_child(child)
+            child.update()
+        else:
+            self.copy_state_to_child(child, copy_board = False)
+            child.board = board
+            child.update(update_board = False)
         return child
 
-    def make_move(self, x, y, colour = None):       # Try the move... if it's legal, create and return the child; else return None
+    def make_move(self, x, y, colour = None, superko = None):
+                                                    # Try the move... if it's legal, create and return the child; else raise IllegalMove
                                                     # Don't use this while reading SGF, as even illegal moves should be allowed there
+                                                    # superko can be None (simple ko only), "positional" or "situational"
 
-        if x < 1 or x > self.board.boardsize or y < 1 or y > self.board.boardsize:
+        board = self.board
+
+        if x < 1 or x > board.boardsize or y < 1 or y > board.boardsize:
             raise IllegalMove
-        if self.board.state[x][y] != EMPTY:
+        if board.colour_at(x, y) != EMPTY:
             raise IllegalMove
 
         # Colour can generally be auto-determined by what colour the last move was...
@@ -484,25 +1339,166 @@ class Node():
 
         # If the move already exists, just return the (first) relevant child...
 
-        for child in self.children:
-            if child.move_coords() == (x, y):
-                if child.move_colour() == colour:
-                    return child
+        child = self.child_for_move(x, y, colour)
+        if child is not None:
+            self.__hand_on_history(child)
+            return child
 
         # Check for legality...
 
-        testchild = self.__make_child_from_move(colour, x, y, append = False)  # Won't get appended to this node as a real child
-        if self.parent:
-            if testchild.board.state == self.parent.board.state:     # Ko
-                raise IllegalMove
-        if testchild.board.state[x][y] == EMPTY:     # Suicide
+        newboard = board.copy()
+        captures = newboard.play_move(colour, x, y)
+
+        if newboard.colour_at(x, y) == EMPTY:      # Suicide
             raise IllegalMove
 
-        # Make real child and return...
+        # Ko. If this node is just a move, only a single capture can recreate the previous
+        # position, so we needn't look at the parent's board otherwise...
+
+        if self.parent:
+            setup = "AB" in self.properties or "AW" in self.properties or "AE" in self.properties
+            if captures == 1 or setup or self.moves_in_this_node() != 1:
+                if newboard.hash == self.parent.position_hash():
+                    raise IllegalMove
+
+        # Superko, i.e. the position can't be one seen before on the path to here (or under
+        # situational superko, can't be one seen before with the same player to move)...
+
+        if superko is not None:
+            history = self.position_history()
+            if superko == "positional":
+                if newboard.hash in history or newboard.hash ^ zobrist_white_to_play in history:
+                    raise IllegalMove
+            elif superko == "situational":
+                if position_key(newboard.hash, colour) in history:
+                    raise IllegalMove
+            else:
+                raise ValueError("unknown superko rule: {}".format(superko))
+
+        # Make real child (with the board we just made) and return...
 
-        child = self.__make_child_from_move(colour, x, y)
+        child = self.__make_child_from_move(colour, x, y, newboard)
+        self.__hand_on_history(child)
         return child
 
+    def legal_moves(self, colour = None, superko = None):
+
+        # The set of points (x, y) where make_move() with the same arguments would succeed,
+        # found without making any children or boards.
+
+        return set(self.__legal_points(colour, superko))
+
+    def legal_moves_mask(self, colour = None, superko = None):
+
+        # As legal_moves(), but as an int with bit x * (boardsize + 2) + y set for each legal
+        # point, i.e. numbered like Board.cells and BitBoard.
+
+        width = self.board.width
+        mask = 0
+        for x, y in self.__legal_points(colour, superko):
+            mask |= 1 << (x * width + y)
+        return mask
+
+    def __legal_points(self, colour, superko):      # Follows make_move() exactly
+
+        board = self.board
+
+        if colour == None:
+            colour = WHITE if self.last_colour_played() == BLACK else BLACK
+        else:
+            assert(colour in [BLACK, WHITE])
+
+        if superko not in [None, "positional", "situational"]:
+            raise ValueError("unknown superko rule: {}".format(superko))
+
+        existing = set()
+        for child in self.children:
+            if child.move_colour() == colour:
+                existing.add(child.move_coords())
+
+        check_ko = None             # Which captures counts can recreate the parent's position
+        if self.parent:
+            setup = "AB" in self.properties or "AW" in self.properties or "AE" in self.properties
+            check_ko = "all" if setup or self.moves_in_this_node() != 1 else 1
+            parent_hash = self.parent.position_hash()
+
+        history = self.position_history() if superko is not None else None
+
+        ret = []
+
+        for x in range(1, board.boardsize + 1):
+            for y in range(1, board.boardsize + 1):
+
+                if board.colour_at(x, y) != EMPTY:
+                    continue
+
+                if (x, y) in existing:
+                    ret.append((x, y))
+                    continue
+
+                outcome = board.preview_move(colour, x, y)
+                if outcome is None:                 # Suicide
+                    continue
+
+                captures, board_hash = outcome
+
+                if check_ko is not None and (check_ko == "all" or captures == 1):
+                    if board_hash == parent_hash:
+                        continue
+
+                if superko == "positional":
+                    if board_hash in history or board_hash ^ zobrist_white_to_play in history:
+                        continue
+                elif superko == "situational":
+                    if position_key(board_hash, colour) in history:
+                        continue
+
+                ret.append((x, y))
+
+        return ret
+
+    def child_for_move(self, x, y, colour):     # The first child with this move (x and y None for a pass), or None
+
+        children = self.children
+
+        if len(children) < child_index_min:
+            for child in children:
+                if child.move_colour() == colour:
+                    if (child.move_was_pass() if x is None else child.move_coords() == (x, y)):
+                        return child
+            return None
+
+        index = self.child_index
+        if index is None or index[0] != self.tree.version or index[1] > len(children):
+            index = (self.tree.version, 0, dict(), set())
+        entries = index[2]
+        indexed = index[3]
+
+        for child in children[index[1]:]:           # Those appended since the index was last brought up to date
+            indexed.add(child)
+            child_colour = child.move_colour()
+            if child_colour is not None:
+                coords = child.move_coords()
+                if coords is not None:
+                    entries.setdefault((child_colour, coords), child)
+                if child.move_was_pass():
+                    entries.setdefault((child_colour, None), child)
+
+        self.child_index = (index[0], len(children), entries, indexed)
+        return entries.get((colour, None if x is None else (x, y)))
+
+    def remove_child(self, child):              # Raises ValueError if it isn't a child
+        children = self.children
+        n = children.index(child)
+        del children[n]
+        index = self.child_index
+        if index is not None and n < index[1]:
+            if child in index[2].values():
+                self.child_index = None             # Rebuilt when next needed, since a later child may have the same move
+            else:
+                index[3].discard(child)
+                self.child_index = (index[0], index[1] - 1, index[2], index[3])
+
     def try_move(self, x, y, colour = None):    # Deprecated
         try:
             return self.make_move(x, y, colour)
@@ -520,21 +1516,24 @@ class Node():
 
         # if the pass already exists, just return the (first) relevant child...
 
-        for child in self.children:
-            if child.move_colour() == colour:
-                if child.move_was_pass():
-                    return child
+        child = self.child_for_move(None, None, colour)
+        if child is not None:
+            self.__hand_on_history(child)
+            return child
 
         key = "W" if colour == WHITE else "B"
 
-        child = Node(parent = self)
-        self.copy_state_to_child(child)
+        child = self.new_child()
         child.set_value(key, "")
+        self.copy_state_to_child(child)
         child.update()
+        self.__hand_on_history(child)
         return child
 
     def delete_property(self, key):
         self.properties.pop(key, None)
+        if key in board_keys:
+            self.invalidate_board()
 
     def add_stone(self, colour, x, y):
 
@@ -585,72 +1584,74 @@ class Node():
 
     def unlink_recursive(self):
 
-        # Recursively remove all references (parents, children) in self and child nodes,
-        # to allow garbage collection to work.
-
-        node = self
+        # Remove all references (parents, children) in self and the nodes below it,
+        # to allow garbage collection to work. Not needed with weak parents (see set_weak_parents).
 
-        while 1:
+        for node in walk(self, order = "post", parsed_only = True):
             node.parent = None
-            if len(node.children) == 0:
-                return
-            elif len(node.children) == 1:           # i.e. just iterate where possible
-                child = node.children[0]
-                node.children = []
-                node = child
-                continue
-            else:
-                for child in node.children:
-                    child.unlink_recursive()
-                node.children = []
-                return
+            node.children = []
 
     def node_path(self):            # Return the path of nodes that leads to this node
 
         path = []
         node = self
 
-        while 1:
+        while node is not None:
             path.append(node)
-            if node.parent:
-                node = node.parent
-            else:
-                break
+            node = node.parent
 
-        return list(reversed(path))
+        path.reverse()
+        return path
 
     def build_board(self):   # Create a board by iterating from a known board, possibly the root
+        return self.__build_board()[0]
 
-        path = self.node_path()
+    def __build_board(self):    # Returns the board and the depth of the node
 
-        if "SZ" not in path[0].properties:
-            raise NoBoardSize
+        # Walk up to the latest node with a board, so we needn't go all the way to the root:
 
-        size = int(path[0].properties["SZ"][0])
+        path = []
+        node = self
+        board = None
+
+        while node is not None:
+            entry = board_cache.peek_entry(node)
+            if entry is not None:
+                board = entry[0].copy()
+                if entry[1] is None:            # e.g. a board that was set directly, so count the depth (just this once)
+                    entry[1] = 0
+                    ancestor = node.parent
+                    while ancestor is not None:
+                        entry[1] += 1
+                        ancestor = ancestor.parent
+                depth = entry[1]
+                break
+            path.append(node)
+            node = node.parent
 
-        if size < 1 or size > 19:
-            raise BadBoardSize
+        path.reverse()
 
-        # Find the latest node with a board:
+        if board is None:
 
-        board = None
-        for n in range(len(path) - 1, -1, -1):
-            node = path[n]
-            if node.__board is not None:
-                board = copy.deepcopy(node.__board)
-                break
-        if not board:
-            board = Board(size)
-            n = 0
+            if "SZ" not in path[0].properties:
+                raise NoBoardSize
 
-        for i in range(n, len(path)):
-            node = path[i]
+            size = int(path[0].properties["SZ"][0])
+
+            if size < 1 or size > 19:
+                raise BadBoardSize
+
+            board = board_classes.get(path[0], Board)(size)
+            depth = -1          # i.e. the root is at depth 0, from an empty board
+
+        interval = board_cache.checkpoint_interval
+
+        for depth, node in enumerate(path, depth + 1):
             board.update_from_node(node)
-            if node is not self:
-                if node.__board is None:
-                    node.__board = copy.deepcopy(board)   # Cache the nodes while we're at it
+            if interval > 0 and depth > 0 and depth % interval == 0:
+                board_cache.put(node, board.copy(), checkpoint = True, depth = depth)
 
-        return board
+        return board, depth
 
     def clear_markup(self):
         allkeys = []
@@ -662,18 +1663,8 @@ class Node():
                 self.properties.pop(key)
 
     def clear_markup_recursive(self):
-        node = self
-        while 1:
+        for node in walk(self):
             node.clear_markup()
-            if len(node.children) == 0:
-                return
-            elif len(node.children) == 1:           # i.e. just iterate where possible
-                node = node.children[0]
-                continue
-            else:
-                for child in node.children:
-                    child.clear_markup_recursive()
-                return
 
     def dyer(self):
         node = self.get_root_node()
@@ -701,12 +1692,15 @@ class Node():
 
 # ---------------------------------------------------------------------------
 
-def new_tree(size):             # Returns a ready-to-use tree with board
+def new_tree(size, board_class = Board, weak_parents = False):     # Returns a ready-to-use tree with board
     if size > 19 or size < 1:
         raise BadBoardSize
 
     root = Node(parent = None)
-    root.board = Board(size)
+    set_board_class(root, board_class)
+    if weak_parents:
+        set_weak_parents(root)
+    root.board = board_class(size)
     root.is_main_line = True
     root.set_value("FF", 4)
     root.set_value("GM", 1)
@@ -726,21 +1720,124 @@ def save(filename, node):           # This should have been the name in the firs
 
 
 def write_tree(outfile, node):
-    outfile.write("(")
-    while 1:
-        outfile.write(";")
-        for key in node.properties:
-            outfile.write(key)
-            for value in node.properties[key]:
-                outfile.write("[{}]".format(safe_string(value)))
-        if len(node.children) > 1:
-            for child in node.children:
-                write_tree(outfile, child)
-            break
-        elif len(node.children) == 1:
-            node = node.children[0]
+
+    # Each variation is written as "(", its nodes, then its own variations, then ")". The stack
+    # holds the variations still to write, each above the None that stands for its parent's ")".
+
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        if node is None:
+            outfile.write(")")
             continue
-        else:
-            break
-    outfile.write(")")
-    return
+        outfile.write("(")
+        stack.append(None)
+        while 1:
+            outfile.write(";")
+            for key in node.properties:
+                outfile.write(key)
+                for value in node.properties[key]:
+                    outfile.write("[{}]".format(safe_string(value)))
+            unparsed = node.unparsed_variations()
+            if unparsed is not None:            # Never looked at, so save the original text as-is
+                for text in unparsed:
+                    outfile.write(text)
+                break
+            if len(node.children) > 1:
+                stack.extend(reversed(node.children))
+                break
+            elif len(node.children) == 1:
+                node = node.children[0]
+                continue
+            else:
+                break
+
+
+def walk_boards(node):
+
+    # Yield (node, board) for the node and every node below it, depth first, in file order.
+    # A single board is used throughout, moved from node to node with push_node() and pop(),
+    # so it's only valid until the next step of the walk; copy it to keep it.
+
+    board = node.board.copy()
+    yield node, board
+
+    stack = [iter(node.children)]
+
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            if stack:
+                board.pop()
+            continue
+        board.push_node(child)
+        yield child, board
+        stack.append(iter(child.children))
+
+
+# The following walk the tree without recursion, so there's no limit on its depth. Except in
+# post order, children are looked at only after their parent has been yielded, so it's fine for
+# the caller to change them then. Chains of single children are followed without the stack.
+
+def walk(node, order = "pre", parsed_only = False):
+
+    # Yield the node and every node below it, depth first, in file order. With order = "post",
+    # each node comes after all the nodes below it rather than before. With parsed_only, the
+    # unparsed variations of a lazily loaded tree (see sgf.py) are skipped rather than parsed.
+
+    if order == "pre":
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            while 1:
+                yield node
+                children = node.parsed_children() if parsed_only else node.children
+                if len(children) != 1:
+                    if children:
+                        stack.extend(reversed(children))
+                    break
+                node = children[0]
+
+    elif order == "post":               # The reverse of a pre order walk that takes the children last first
+        nodes = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.parsed_children() if parsed_only else node.children)
+        for node in reversed(nodes):
+            yield node
+
+    else:
+        raise ValueError("unknown order: {}".format(order))
+
+
+def walk_mainline(node):            # Yield the node and the (local) main line below it
+    while 1:
+        yield node
+        if len(node.children) == 0:
+            return
+        node = node.children[0]
+
+
+def walk_leaves(node):              # Yield each node with no children, in file order
+    for node in walk(node):
+        if len(node.children) == 0:
+            yield node
+
+
+def walk_with_depth(node):          # As walk(), but yield (node, depth), with the node itself at depth 0
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        while 1:
+            yield node, depth
+            children = node.children
+            depth += 1
+            if len(children) != 1:
+                if children:
+                    stack.extend((child, depth) for child in reversed(children))
+                break
+            node = children[0]
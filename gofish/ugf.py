@@ -3,8 +3,9 @@
 
 from gofish.constants import *
 from gofish.tree import *
+from gofish.utils import *
 
-def parse_ugf(ugf):     # Note that the files are often (always?) named .ugi
+def parse_ugf(ugf, header_only = False, max_moves = None):     # Note that the files are often (always?) named .ugi
 
     root = Node(parent = None)
     node = root
@@ -13,14 +14,13 @@ def parse_ugf(ugf):     # Note that the files are often (always?) named .ugi
     handicap = None
 
     handicap_stones_set = 0
+    moves = 0
 
     coordinate_type = ""
 
-    lines = ugf.split("\n")
-
     section = None
 
-    for line in lines:
+    for line in iter_lines(ugf):
 
         line = line.strip()
 
@@ -39,6 +39,9 @@ def parse_ugf(ugf):     # Note that the files are often (always?) named .ugi
                     if handicap < 0:
                         raise ParserFail
 
+                    if header_only:
+                        return root
+
                 continue
 
         except IndexError:
@@ -134,9 +137,12 @@ def parse_ugf(ugf):     # Note that the files are often (always?) named .ugi
                 key = "AB"
                 node.add_value(key, value)      # add_value not set_value
             else:
+                if max_moves is not None and moves >= max_moves:
+                    break
                 node = Node(parent = node)
                 key = colour
                 node.set_value(key, value)
+                moves += 1
 
     if len(root.children) == 0:     # We'll assume we failed in this case
         raise ParserFail
@@ -127,6 +127,17 @@ def safe_string(s):     # "safe" meaning safely escaped \ and ] characters
     return safe_s
 
 
+def iter_lines(s):                                  # Like s.split("\n") but as needed, so a parser can stop early
+    start = 0
+    while 1:
+        end = s.find("\n", start)
+        if end == -1:
+            yield s[start:]
+            return
+        yield s[start:end]
+        start = end + 1
+
+
 def handicap_points(boardsize, handicap, tygem = False):
 
     points = set()
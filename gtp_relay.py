@@ -13,6 +13,8 @@ colour_lookup = {BLACK: "black", WHITE: "white"}
 WIDTH, HEIGHT = 621, 621
 GAP = 31
 
+SUPERKO = None              # Or "positional" or "situational", to reject moves that repeat an earlier position
+
 MOTD = """
   Fohristiwhirl's GTP relay.
 """
@@ -155,7 +157,8 @@ class GTP_GUI(tkinter.Canvas):
         if self.awaiting_move:
             return
 
-        self.node = gofish.new_tree(size)
+        self.node = gofish.new_tree(size, weak_parents = True)
+        self.root = self.node       # Nodes hold their parents weakly, so we must hold the root; the old tree is freed
 
         for cmd in ["boardsize {}".format(self.node.board.boardsize), "clear_board", "komi 0"]:
             send_command(cmd)
@@ -175,7 +178,8 @@ class GTP_GUI(tkinter.Canvas):
         if self.awaiting_move:
             return
 
-        self.node = gofish.new_tree(self.node.board.boardsize)
+        self.node = gofish.new_tree(self.node.board.boardsize, weak_parents = True)
+        self.root = self.node
 
         for cmd in ["boardsize {}".format(self.node.board.boardsize), "clear_board", "komi 0"]:
             send_command(cmd)
@@ -212,7 +216,7 @@ class GTP_GUI(tkinter.Canvas):
             x, y = board_pos_from_screen_pos(event.x, event.y, self.node.board.boardsize)
 
             try:
-                self.node = self.node.make_move(x, y, colour = self.human_colour)
+                self.node = self.node.make_move(x, y, colour = self.human_colour, superko = SUPERKO)
             except gofish.IllegalMove:
                 return
 
@@ -260,7 +264,7 @@ class GTP_GUI(tkinter.Canvas):
             else:
                 x, y = point
             try:
-                result = self.node.make_move(x, y, colour = self.engine_colour)
+                result = self.node.make_move(x, y, colour = self.engine_colour, superko = SUPERKO)
             except gofish.IllegalMove:
                 print("ERROR: got illegal move {}".format(message))
                 return
@@ -0,0 +1,76 @@
+import pytest
+
+import gofish
+
+
+GAMES = {
+    "plain.sgf": "(;SZ[19]PB[Kim]PW[Lee]KM[6.5];B[pd];W[dp];B[pp];W[];B[tt])",
+    "variations.sgf": "(;SZ[9]AB[cc][gg]C[setup];W[ee](;B[ec];W[dc])(;B[ce](;W[cd])(;W[dd]C[x])))",
+    "game.gib": """\\[GAMEBLACKNAME=Kim (5d)\\]
+\\[GAMEWHITENAME=Lee (6d)\\]
+\\[GAMEINFOMAIN=GBKIND:3,GTYPE:0,GCDT:0,GTIME:0-0-0,GRLT:0,ZIPSU:35,GONGJE:65,DUM:0\\]
+INI 0 1 0 &4
+STO 0 2 1 15 3
+STO 0 3 2 3 15
+""",
+}
+
+BAD = {
+    "junk.sgf": "this is not a game record\n",
+    "huge.sgf": "(;SZ[30];B[aa])",
+}
+
+
+def nodes(root):
+    return [(dict(node.properties), node.moves_made, node.is_main_line) for node in gofish.walk(root)]
+
+
+@pytest.fixture
+def files(tmp_path):
+    ret = []
+    for name, text in list(GAMES.items()) + list(BAD.items()):
+        path = tmp_path / name
+        path.write_text(text)
+        ret.append(str(path))
+    ret.append(str(tmp_path / "missing.sgf"))
+    return ret
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_load_many_matches_load(files, workers):
+    results = {filename: (result, error) for filename, result, error in gofish.load_many(files, workers = workers, chunksize = 1)}
+    assert sorted(results) == sorted(files)         # A bad file doesn't stop the rest
+
+    for filename in files[:len(GAMES)]:
+        result, error = results[filename]
+        assert error is None
+        assert nodes(result) == nodes(gofish.load(filename))
+
+    errors = [type(results[filename][1]) for filename in files[len(GAMES):]]
+    assert errors == [gofish.ParserFail, gofish.BadBoardSize, FileNotFoundError]
+    assert all(results[filename][0] is None for filename in files[len(GAMES):])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_load_many_summary(files, workers):
+    results = {filename: (result, error) for filename, result, error in gofish.load_many(files, workers = workers, summary = True)}
+
+    summary, error = results[files[0]]
+    assert error is None
+    assert summary["properties"] == gofish.load(files[0]).properties
+    assert summary["moves"] == [(gofish.BLACK, (16, 4)), (gofish.WHITE, (4, 16)), (gofish.BLACK, (16, 16)),
+                                (gofish.WHITE, None), (gofish.BLACK, None)]
+
+    summary, error = results[files[1]]              # Just the main line
+    assert summary["moves"] == [(gofish.WHITE, (5, 5)), (gofish.BLACK, (5, 3)), (gofish.WHITE, (4, 3))]
+
+    assert isinstance(results[files[-1]][1], FileNotFoundError)
+
+
+def test_flatten_round_trip():
+    root = gofish.parse_sgf(GAMES["variations.sgf"])
+    gofish.cleanup(root)
+
+    again = gofish.unflatten_tree(gofish.flatten_tree(root))
+    assert nodes(again) == nodes(root)
+    assert again.children[0].children[1].children[1].get_value("C") == "x"
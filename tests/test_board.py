@@ -0,0 +1,130 @@
+import pickle
+import random
+
+import pytest
+
+import gofish
+
+
+BOARD_CLASSES = [gofish.Board, gofish.BitBoard]
+
+
+@pytest.mark.parametrize("board_class", BOARD_CLASSES)
+def test_state_keeps_old_layout(board_class):
+    board = board_class(9)
+    board.play_move(gofish.BLACK, 3, 4)
+    board.play_move(gofish.WHITE, 9, 9)
+
+    expected = [[0] * 10 for x in range(10)]
+    expected[3][4] = gofish.BLACK
+    expected[9][9] = gofish.WHITE
+    assert [list(row) for row in board.state] == expected
+    assert board.state == expected
+
+
+def test_state_writes_reach_the_board():
+    board = gofish.Board(9)
+    board.state[2][2] = gofish.WHITE
+    board.state[0][5] = gofish.BLACK        # The 0 indexes are ignored, as they always were
+    board.state[5][0] = gofish.BLACK
+    board.rehash()
+
+    assert board.colour_at(2, 2) == gofish.WHITE
+    assert board.state[0][5] == board.state[5][0] == gofish.EMPTY
+    assert pickle.loads(pickle.dumps(board)).state == board.state
+
+
+def random_moves(seed, size, count):
+
+    # Nodes for a random game with plenty of captures, and some moves onto stones,
+    # passes and setup stones, which push_node() has to undo too.
+
+    rng = random.Random(seed)
+    nodes = []
+    for i in range(count):
+        node = gofish.Node(parent = None)
+        point = gofish.string_from_point(rng.randint(1, size), rng.randint(1, size))
+        r = rng.random()
+        if r < 0.03:
+            node.set_value("AB", point)
+        elif r < 0.05:
+            node.set_value("W", "")
+        else:
+            node.set_value("BW"[i % 2], point)
+        nodes.append(node)
+    return nodes
+
+
+def snapshot(board):
+    return bytes(board.cells), board.hash, sorted((sorted(points), sorted(liberties)) for points, liberties in board.groups())
+
+
+@pytest.mark.parametrize("board_class", BOARD_CLASSES)
+@pytest.mark.parametrize("seed", range(5))
+def test_push_and_pop_restore_exactly(board_class, seed):
+    board = board_class(9)
+    history = []
+    for node in random_moves(seed, 9, 300):
+        history.append(snapshot(board))
+        board.push_node(node)
+        if len(history) % 3 == 0:
+            board.pop()
+            assert snapshot(board) == history.pop()
+    while history:
+        board.pop()
+        assert snapshot(board) == history.pop()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bitboard_matches_board(seed):
+    board = gofish.Board(13)
+    bitboard = gofish.BitBoard(13)
+    for node in random_moves(seed, 13, 400):
+        board.push_node(node)
+        bitboard.push_node(node)
+        assert snapshot(bitboard) == snapshot(board)
+
+        fresh = gofish.Board(13)            # The hash is the same as one worked out from scratch
+        fresh.cells[:] = board.cells
+        fresh.rehash()
+        assert fresh.hash == board.hash
+
+
+def random_tree(seed, size, count, board_class):
+
+    # A tree of random moves with many variations, and some passes and setup stones.
+
+    rng = random.Random(seed)
+    root = gofish.new_tree(size, board_class = board_class)
+    node = root
+    for i in range(count):
+        if rng.random() < 0.1:
+            for n in range(rng.randint(1, 10)):
+                node = node.parent or node
+        node = gofish.Node(parent = node)
+        point = gofish.string_from_point(rng.randint(1, size), rng.randint(1, size))
+        r = rng.random()
+        if r < 0.05:
+            node.set_value(rng.choice(["AB", "AW", "AE"]), point)
+        elif r < 0.08:
+            node.set_value("BW"[i % 2], "")
+        else:
+            node.set_value("BW"[i % 2], point)
+    return root
+
+
+@pytest.mark.parametrize("board_class", BOARD_CLASSES)
+@pytest.mark.parametrize("seed", range(3))
+def test_walk_boards_matches_build_board(board_class, seed):
+    root = random_tree(seed, 9, 500, board_class)
+    rng = random.Random(seed)
+    gofish.board_cache.clear()
+    count = 0
+    for node, board in gofish.walk_boards(root):
+        expected = node.build_board()
+        assert bytes(board.cells) == bytes(expected.cells)
+        assert board.hash == expected.hash
+        if rng.random() < 0.2:              # So the walk goes on sometimes with groups worked out, sometimes without
+            assert snapshot(board) == snapshot(expected)
+        count += 1
+    assert count == 501
@@ -0,0 +1,30 @@
+import pytest
+
+import gofish
+
+numpy = pytest.importorskip("numpy")
+
+
+GAME = "(;SZ[9];B[cc];W[cd];B[dd];W[dc];B[bd];W[ce];B[de];W[cb];B[pass])"
+
+
+def test_features_from_roots_and_files(tmp_path):
+    filename = str(tmp_path / "game.sgf")
+    with open(filename, "w") as outfile:
+        outfile.write(GAME)
+
+    from_roots = gofish.extract_features(iter([gofish.parse_sgf(GAME)] * 2), planes = gofish.feature_planes)
+    from_files = gofish.extract_features([filename, filename], planes = gofish.feature_planes)
+
+    assert from_roots.shape == (20, len(gofish.feature_planes), 9, 9)
+    assert (from_roots == from_files).all()
+
+    black = gofish.feature_planes.index("black")
+    last_move = gofish.feature_planes.index("last_move_1")
+    assert from_roots[1, black, 2, 2] == 1 and from_roots[1, black].sum() == 1
+    assert from_roots[2, last_move, 2, 3] == 1 and from_roots[2, last_move].sum() == 1
+
+
+def test_features_exports():
+    assert not hasattr(gofish, "main_line")
+    assert not hasattr(gofish, "numpy")
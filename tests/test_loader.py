@@ -0,0 +1,170 @@
+import io
+
+import pytest
+
+import gofish
+
+
+class CountingBytesIO(io.BytesIO):         # Fails the test, rather than hanging, if read past the end too often
+
+    def __init__(self, data):
+        io.BytesIO.__init__(self, data)
+        self.empty_reads = 0
+
+    def read(self, size = -1):
+        chunk = io.BytesIO.read(self, size)
+        if not chunk:
+            self.empty_reads += 1
+            assert self.empty_reads < 10, "kept reading after the end of the stream"
+        return chunk
+
+
+def test_iter_sgf_games_binary_stream():
+    source = CountingBytesIO(b"(;SZ[9];B[aa])(;SZ[9];W[bb])")
+    games = list(gofish.iter_sgf_games(source, chunk_size = 4))
+    assert [game.children[0].properties for game in games] == [{"B": ["aa"]}, {"W": ["bb"]}]
+
+
+def test_iter_sgf_games_text_stream():
+    source = io.StringIO("(;SZ[9]C[café];B[aa](;W[bb])(;W[cc]))\n(;SZ[13])")
+    games = list(gofish.iter_sgf_games(source, chunk_size = 3))
+    assert len(games) == 2
+    assert games[0].get_value("C") == "café"
+    assert len(games[0].children[0].children) == 2
+    assert games[1].get_value("SZ") == "13"
+
+
+def test_iter_sgf_games_skips_bad_games():
+    source = io.BytesIO(b"(;SZ[9];B[aa])(;B[ab](;W[cc])((;W[dd])) ();W[ee])(;SZ[30])(;SZ[9];W[bb](;B[cc])(;B[dd]))")
+    games = list(gofish.iter_sgf_games(source))
+    assert len(games) == 2
+    assert games[0].children[0].get_value("B") == "aa"
+    assert len(games[1].children[0].children) == 2
+
+
+GIB = """\\[GAMEBLACKNAME=Kim (5d)\\]
+\\[GAMEWHITENAME=Lee (6d)\\]
+\\[GAMEINFOMAIN=GBKIND:3,GTYPE:0,GCDT:0,GTIME:0-0-0,GRLT:0,ZIPSU:35,GONGJE:65,DUM:0\\]
+INI 0 1 0 &4
+STO 0 2 1 15 3
+STO 0 3 2 3 15
+"""
+
+NGF = """Some game
+19
+WhiteGuy 5d
+BlackGuy 4d
+http
+0
+0
+6
+20150101 [12:00]
+5
+White wins by resign
+PMABBQE
+PMACWDQ
+"""
+
+UGF = """[Header]
+Lang=JPN
+Size=19
+Hdcp=0,6.5
+PlayerB=Kim,5d
+PlayerW=Lee,6d
+CoordinateType=IGS
+[Data]
+QD,B1,1,0
+DP,W2,2,0
+"""
+
+SGF = "(;GM[1]FF[4]SZ[19]PB[Kim];B[pd];W[dp])"
+
+
+@pytest.mark.parametrize("prefix, expected", [
+    (SGF.encode(), "sgf"),
+    (SGF, "sgf"),                                               # str works too
+    (b"\xef\xbb\xbf" + SGF.encode(), "sgf"),                    # UTF-8 BOM
+    (b"\r\n  ((" + SGF[1:].encode(), "sgf"),
+    (b"Downloaded from somewhere\n" + SGF.encode(), None),       # Leading junk: unsure, so load() tries SGF then the extension
+    (GIB.encode(), "gib"),
+    (b"\\[GAMEINFOMAIN=GBKIND:3\\]\n", "gib"),
+    (NGF.encode(), "ngf"),
+    (NGF.split("PM")[0].encode(), None),                        # The NGF layout, but no moves
+    (UGF.encode(), "ugf"),
+    (UGF.upper().encode(), "ugf"),
+    (b"this is not a game record\nat all\n", None),
+    (b"", None),
+])
+def test_detect_format(prefix, expected):
+    assert gofish.detect_format(prefix) == expected
+
+
+@pytest.mark.parametrize("name, text, proper_name", [
+    ("game", SGF, "game.sgf"),
+    ("ugf.sgf", UGF, "game.ugi"),
+    ("gib.ngf", GIB, "game.gib"),
+    ("ngf.gib", NGF, "game.ngf"),
+    ("sgf.ugi", SGF, "game.sgf"),
+    ("bom.sgf", "\ufeff" + SGF, "game.sgf"),
+])
+def test_load_goes_by_content(tmp_path, name, text, proper_name):
+    path = tmp_path / name
+    path.write_text(text, encoding = "utf-8")
+    proper = tmp_path / proper_name
+    proper.write_text(text.lstrip("\ufeff"), encoding = "utf-8")
+
+    root = gofish.load(str(path))
+    expected = gofish.load(str(proper))
+    assert [node.properties for node in gofish.walk(root)] == [node.properties for node in gofish.walk(expected)]
+    assert len(list(gofish.walk(root))) == 3
+    assert gofish.load_header(str(path)).properties == expected.properties
+
+
+def test_load_header_matches_load(tmp_path):
+    for name, text in [("game.gib", GIB), ("game.ngf", NGF), ("game.sgf", "(;SZ[13]PB[Kim];B[aa];W[bb])")]:
+        path = tmp_path / name
+        path.write_text(text)
+        header = gofish.load_header(str(path))
+        root = gofish.load(str(path))
+        assert header.properties == root.properties
+        assert len(header.children) == 0
+
+
+def test_load_header_rejects_garbage(tmp_path):
+    for name in ["junk.gib", "junk.ngf", "junk.ugi", "junk.sgf"]:
+        path = tmp_path / name
+        path.write_text("this is not a game record\nat all\n")
+        try:
+            gofish.load_header(str(path))
+        except gofish.ParserFail:
+            pass
+        else:
+            assert False, "{} loaded".format(name)
+
+
+def test_load_header_detects_format_before_extension(tmp_path):
+    path = tmp_path / "misnamed.gib"
+    path.write_text("(;SZ[9]PB[Someone];B[aa])")
+    assert gofish.load_header(str(path)).get_value("PB") == "Someone"
+
+
+def test_save_over_lazily_loaded_file(tmp_path):
+    filename = str(tmp_path / "game.sgf")
+    with open(filename, "w") as outfile:
+        outfile.write("(;SZ[9];B[aa](;W[bb];B[cc])(;W[dd](;B[ee])(;B[ff])))")
+
+    root = gofish.load(filename, lazy = True)
+    root.save(filename)         # The unparsed variations must not be read from the file being written
+
+    again = gofish.load(filename)
+    assert [len(list(gofish.walk(tree))) for tree in [root, again]] == [7, 7]
+    assert again.children[0].children[1].children[1].get_value("B") == "ff"
+
+
+def test_lazy_load_other_format(tmp_path):
+    filename = str(tmp_path / "game.gib")
+    with open(filename, "w") as outfile:
+        outfile.write(GIB)
+
+    root = gofish.load(filename, lazy = True)
+    assert root.get_value("PB") == gofish.load(filename).get_value("PB")
@@ -0,0 +1,205 @@
+import io
+import random
+
+import pytest
+
+import gofish
+
+
+def count_nodes(root):
+    return len(list(gofish.walk(root)))
+
+
+def test_max_moves_requires_main_line_only():
+    with pytest.raises(ValueError):
+        gofish.parse_sgf("(;B[aa];W[bb])", max_moves = 1)
+    with pytest.raises(ValueError):
+        gofish.parse_sgf_stream(io.StringIO("(;B[aa];W[bb])"), max_moves = 1)
+
+
+def test_max_moves_main_line():
+    sgf = "(;SZ[9];B[aa];W[bb](;B[cc];W[dd])(;B[ee]))"
+    assert count_nodes(gofish.parse_sgf(sgf, main_line_only = True, max_moves = 2)) == 3
+    assert count_nodes(gofish.parse_sgf_stream(io.StringIO(sgf), chunk_size = 5, main_line_only = True, max_moves = 3)) == 4
+
+
+def test_max_moves_other_formats():
+    gib = "\\[GAMEBLACKNAME=A\\]\nSTO 0 2 1 15 3\nSTO 0 3 2 3 15\nSTO 0 4 1 15 15\n"
+    assert count_nodes(gofish.parse_gib(gib)) == 4
+    assert count_nodes(gofish.parse_gib(gib, max_moves = 2)) == 3
+
+
+def test_parse_sgf_stream_binary():
+    sgf = "  ((;SZ[9]C[caf\u00e9 \\] \u00fc];B[aa];W[bb]))\n"
+    for encoding in ["utf-8", "latin-1"]:
+        root = gofish.parse_sgf_stream(io.BytesIO(sgf.encode(encoding)), chunk_size = 3, encoding = encoding)
+        assert root.get_value("C") == "caf\u00e9 ] \u00fc"
+        assert count_nodes(root) == 3
+
+
+LAZY = "(;SZ[9];B[aa](;W[bb];B[cc](;W[dd])(;W[ee]))(;W[ff]))"
+
+
+def test_lazy_malformed_variation_fails_at_load():
+    for sgf in ["(;B[aa]((;W[bb])))", "(;B[aa]())", "(;B[aa]([cc]))", "(;B[aa](;W[bb])(B[cc]))"]:
+        with pytest.raises(gofish.ParserFail):
+            gofish.parse_sgf(sgf)
+        with pytest.raises(gofish.ParserFail):
+            gofish.parse_sgf_lazy(sgf)          # Not just when the variation is looked at
+        with pytest.raises(gofish.ParserFail):
+            gofish.parse_sgf_lazy(sgf.encode())
+
+
+def test_lazy_internal_traversals_do_not_parse():
+    root = gofish.parse_sgf_lazy(LAZY)
+    move = root.children[0]
+    assert move.unparsed_variations() == ["(;W[bb];B[cc](;W[dd])(;W[ee]))", "(;W[ff])"]
+
+    assert len(list(gofish.walk(root, parsed_only = True))) == 2
+    root.fix_main_line_status_recursive()
+    root.update_recursive(update_board = False)
+    gofish.set_weak_parents(root)
+    root.invalidate_board()
+    move.invalidate_board()
+    assert move.unparsed_variations() is not None
+
+    assert len(list(gofish.walk(root))) == 7
+    assert move.unparsed_variations() is None
+
+    root = gofish.parse_sgf_lazy(LAZY)
+    move = root.children[0]
+    root.unlink_recursive()
+    assert move.parent is None and move.unparsed_variations() is None and move.children == []
+
+
+# The character-by-character parser that the tokenizer replaced, kept as the reference
+# for what every parser should produce.
+
+def reference_parse(sgf, main_line_only = False):
+    sgf = sgf.strip().lstrip("(")
+    root, __ = reference_tree(sgf, None, main_line_only)
+    return root
+
+
+def reference_tree(sgf, parent_of_local_root, main_line_only):
+
+    root = None
+    node = None
+    inside = False
+    value = ""
+    key = ""
+    keycomplete = False
+    chars_to_skip = 0
+
+    for i, c in enumerate(sgf):
+
+        if chars_to_skip:
+            chars_to_skip -= 1
+            continue
+
+        if inside:
+            if c == "\\":
+                try:
+                    value += sgf[i + 1]
+                except IndexError:
+                    raise gofish.ParserFail
+                chars_to_skip = 1
+            elif c == "]":
+                inside = False
+                if node is None:
+                    raise gofish.ParserFail
+                node.add_value(key, value)
+            else:
+                value += c
+        else:
+            if c == "[":
+                value = ""
+                inside = True
+                keycomplete = True
+            elif c == "(":
+                if main_line_only:
+                    continue
+                if node is None:
+                    raise gofish.ParserFail
+                __, chars_to_skip = reference_tree(sgf[i + 1:], node, main_line_only)
+            elif c == ")":
+                if main_line_only:
+                    break
+                if root is None:
+                    raise gofish.ParserFail
+                return root, i + 1
+            elif c == ";":
+                node = gofish.Node(parent = parent_of_local_root if node is None else node)
+                root = root or node
+            elif c in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+                if keycomplete:
+                    key = ""
+                    keycomplete = False
+                key += c
+
+    if root is None:
+        raise gofish.ParserFail
+
+    return root, i + 1
+
+
+def shape(root):                # Everything the parsers produce, in a form that can be compared
+    return [(depth, sorted(node.properties.items())) for node, depth in gofish.walk_with_depth(root)]
+
+
+def random_sgf(rng):
+
+    values = ["aa", "", "pd", "a\\]b", "(;x)", "C\\\\", "é中", " spaced ", "x[y", "semi;colon"]
+
+    def sequence(depth):
+        text = ""
+        for n in range(rng.randint(1, 4)):
+            text += rng.choice([";", " ;", "\n;"])
+            for k in range(rng.randint(0, 3)):
+                key = rng.choice(["B", "W", "C", "AB", "AddWhite", "GN"])
+                text += key + "".join("[{}]".format(rng.choice(values)) for v in range(rng.randint(1, 2)))
+        if depth < 3:
+            for n in range(rng.choice([0, 0, 1, 2, 3])):
+                text += rng.choice(["", "\n"]) + "(" + sequence(depth + 1) + ")"
+        return text
+
+    return "(" + sequence(0) + ")"
+
+
+def all_parsers(sgf):
+    yield "parse_sgf", gofish.parse_sgf(sgf)
+    yield "parse_sgf_bytes", gofish.parse_sgf_bytes(sgf.encode("utf-8"), "utf-8")
+    for chunk_size in [1, 3, 64]:
+        yield "parse_sgf_stream", gofish.parse_sgf_stream(io.StringIO(sgf), chunk_size = chunk_size)
+        yield "parse_sgf_stream binary", gofish.parse_sgf_stream(io.BytesIO(sgf.encode("utf-8")), chunk_size = chunk_size)
+    yield "parse_sgf_lazy", gofish.parse_sgf_lazy(sgf)
+    yield "parse_sgf_lazy bytes", gofish.parse_sgf_lazy(sgf.encode("utf-8"), "utf-8")
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_parsers_match_reference(seed):
+    sgf = random_sgf(random.Random(seed))
+    expected = shape(reference_parse(sgf))
+    for name, root in all_parsers(sgf):
+        assert shape(root) == expected, name
+
+    expected = shape(reference_parse(sgf, main_line_only = True))
+    assert shape(gofish.parse_sgf(sgf, main_line_only = True)) == expected
+    assert shape(gofish.parse_sgf_stream(io.StringIO(sgf), chunk_size = 5, main_line_only = True)) == expected
+
+
+@pytest.mark.parametrize("sgf", ["((;B[aa]))", "  (;B[aa];W[bb]) trailing", "(;B[aa](;W[bb])(;W[cc]))extra)",
+                                 "(;C[a\\\\];B[aa])", "(;B[aa];W[bb]", "(;B[aa](;W[bb]"])
+def test_parsers_match_reference_on_odd_input(sgf):
+    expected = shape(reference_parse(sgf))
+    for name, root in all_parsers(sgf):
+        assert shape(root) == expected, name
+
+
+@pytest.mark.parametrize("sgf", ["", "B[aa]", "(B[aa])", "(;B[aa]((;W[bb])))", "(;B[aa]())"])
+def test_parsers_reject_what_the_reference_rejects(sgf):
+    with pytest.raises(gofish.ParserFail):
+        reference_parse(sgf)
+    for parser in [gofish.parse_sgf, gofish.parse_sgf_lazy, lambda sgf: gofish.parse_sgf_stream(io.StringIO(sgf), chunk_size = 2)]:
+        with pytest.raises(gofish.ParserFail):
+            parser(sgf)
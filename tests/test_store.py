@@ -0,0 +1,140 @@
+import io
+import random
+
+import pytest
+
+import gofish
+
+
+SGF = "(;GM[1]FF[4]CA[UTF-8]SZ[19]PB[Kim]PW[Lee]AB[dd][pp]C[a \\] b];B[pd]C[first];W[tt];B[dp]LB[dd:A](;W[qp];B[aa]BL[30])(;W[cc]TR[dd][ee];B[zz]))"
+
+
+def as_text(node):
+    out = io.StringIO()
+    gofish.write_tree(out, node)
+    return out.getvalue()
+
+
+def properties_in_order(root):
+    return [dict(node.properties) for node in gofish.walk(root)]
+
+
+def test_round_trip(tmp_path):
+    original = tmp_path / "game.sgf"
+    original.write_text(SGF)
+    root = gofish.load(str(original))
+
+    store = gofish.TreeStore()
+    store.add_tree(root)
+    assert len(store) == 8
+
+    assert as_text(store.root()) == as_text(root)
+
+    copy = tmp_path / "copy.sgf"
+    gofish.save(str(copy), store.node(5))      # Saving any node saves the whole tree
+    assert properties_in_order(gofish.load(str(copy))) == properties_in_order(root)
+
+
+def test_set_values_packs_moves():
+    store = gofish.TreeStore()
+    root = store.add_node()
+    index = store.add_node(root, {"B": ["pd"]})
+    assert store.moves[index] == gofish.encode_move("B", "pd")
+    assert index not in store.extra
+
+    store.set_values(index, "B", ["qq"])        # Overwriting the packed move
+    assert store.get_values(index, "B") == ["qq"]
+    assert index not in store.extra
+
+    store.set_values(index, "B", ["pd", "qq"])  # Too many values to pack
+    assert store.moves[index] == 0
+    assert store.get_values(index, "B") == ["pd", "qq"]
+
+    store.set_values(index, "B", ["dd"])
+    assert store.get_values(index, "B") == ["dd"]
+    assert list(store.keys(index)) == ["B"]
+
+    store.set_values(index, "W", ["cc"])        # Only one move is packed, the other goes to the side table
+    assert sorted(store.keys(index)) == ["B", "W"]
+    assert store.get_values(index, "W") == ["cc"]
+
+    other = store.add_node(root, {"W": [""]})   # A pass packs too
+    assert store.moves[other] == gofish.encode_move("W", "")
+    store.set_values(other, "W", ["long"])      # But an odd value doesn't
+    assert store.moves[other] == 0
+    assert store.get_values(other, "W") == ["long"]
+    store.delete_values(other, "W")
+    assert store.get_values(other, "W") is None
+    assert other not in store.extra
+
+
+def test_add_tree_merges_duplicate_lines():
+    games = [gofish.parse_sgf(sgf) for sgf in ["(;SZ[19];B[pd];W[dp];B[pp])",
+                                               "(;SZ[19];B[pd]C[popular];W[dp];B[dd])",
+                                               "(;SZ[19];B[qd])",
+                                               "(;SZ[19];B[pd];W[dp];B[pp])"]]
+    store = gofish.TreeStore()
+    store.add_tree(games[0])
+    for game in games[1:]:
+        for child in game.children:
+            store.add_tree(child, 0, merge = True)
+
+    assert len(store) == 6
+    root = store.root()
+    assert [child.get_value("B") for child in root.children] == ["pd", "qd"]
+
+    pd = root.children[0]
+    assert pd.get_value("C") == "popular"       # Taken on from the second game
+    assert [child.get_value("B") for child in pd.children[0].children] == ["pp", "dd"]
+
+
+def test_views_are_shared():
+    store = gofish.TreeStore()
+    store.add_tree(gofish.parse_sgf(SGF))
+
+    root = store.root()
+    node = store.node(3)
+    assert store.node(3) is node
+    assert store.node(0) is root and root.parent is None
+    assert root.children[0] is store.node(1)
+    assert node.parent is store.node(2) and node.parent.parent.parent is root
+    assert node.children == [store.node(4), store.node(6)]
+
+
+def test_make_move():
+    root = gofish.new_store(9)
+    store = root.store
+
+    node = root.make_move(3, 3)
+    assert isinstance(node, gofish.StoreNode)
+    assert node.parent is root and root.children == [node]
+    assert root.make_move(3, 3) is node         # The existing child
+    reply = node.make_move(4, 4)
+    assert len(store) == 3
+    assert reply.board.colour_at(3, 3) == gofish.BLACK
+    assert reply.board.colour_at(4, 4) == gofish.WHITE
+
+    with pytest.raises(gofish.IllegalMove):
+        reply.make_move(3, 3)
+    assert len(store) == 3
+
+    assert as_text(node) == "(;B[cc];W[dd])"
+    written = gofish.parse_sgf(as_text(root))
+    assert written.get_value("SZ") == "9"
+    assert written.children[0].get_value("B") == "cc"
+    assert written.children[0].children[0].get_value("W") == "dd"
+
+
+def test_dyer():
+    rng = random.Random(0)
+    node = gofish.new_tree(19)
+    while node.moves_made < 80:
+        try:
+            node = node.make_move(rng.randint(1, 19), rng.randint(1, 19))
+        except gofish.IllegalMove:
+            pass
+
+    store = gofish.TreeStore()
+    store.add_tree(node.get_root_node())
+    assert "?" not in node.dyer()
+    assert store.dyer() == store.node(50).dyer() == node.dyer()
@@ -0,0 +1,283 @@
+import gc, random, weakref
+
+import pytest
+
+import gofish
+
+
+def line_of_moves(root, moves):
+    node = root
+    for colour, point in moves:
+        node = gofish.Node(parent = node)
+        node.set_value(colour, point)
+    return node
+
+
+def test_boardsize_is_kept_per_tree():
+    first = gofish.new_tree(19)
+    second = gofish.new_tree(19)
+    first_leaf = line_of_moves(first, [("B", "pd"), ("W", "qq")])
+    second_leaf = line_of_moves(second, [("B", "pd"), ("W", "qq")])
+
+    assert first_leaf.move_coords() == second_leaf.move_coords() == (17, 17)
+    cached = second_leaf.move_cache
+
+    first.set_value("SZ", 9)                # W[qq] is off a 9x9 board, so it's a pass there
+
+    assert first_leaf.boardsize() == 9
+    assert first_leaf.move_coords() is None and first_leaf.move_was_pass()
+    assert second_leaf.boardsize() == 19
+    assert second_leaf.move_cache is cached     # The other tree's cached moves are still good
+
+
+def test_regrafted_subtree_takes_the_new_tree():
+    small = gofish.new_tree(9)
+    top = line_of_moves(small, [("B", "cc")])
+    leaf = line_of_moves(top, [("W", "qq")])
+    for i in range(9):                          # Enough children for top to index them
+        line_of_moves(top, [("W", gofish.string_from_point(i + 1, 1))])
+
+    assert leaf.move_coords() is None           # Off a 9x9 board, so a pass
+    assert top.child_for_move(None, None, gofish.WHITE) is leaf
+    assert leaf.board.colour_at(3, 3) == gofish.BLACK
+
+    big = gofish.new_tree(19)
+    big.set_value("AW", "cc")
+    small.remove_child(top)
+    top.parent = big
+    big.children.append(top)
+
+    assert leaf.boardsize() == 19
+    assert leaf.move_coords() == (17, 17) and not leaf.move_was_pass()
+    assert top.child_for_move(None, None, gofish.WHITE) is None
+    assert top.child_for_move(17, 17, gofish.WHITE) is leaf
+    assert leaf.board.colour_at(17, 17) == gofish.WHITE
+    assert leaf.board.colour_at(3, 3) == gofish.BLACK       # Played over the new root's AW[cc]
+
+
+def many_children(count):
+    root = gofish.new_tree(19)
+    children = []
+    for i in range(count):
+        child = gofish.Node(parent = root)
+        child.set_value("B", gofish.string_from_point(i + 1, 1))
+        children.append(child)
+    return root, children
+
+
+def test_child_index_after_remove_child():
+    root, children = many_children(12)
+    assert root.child_for_move(3, 1, gofish.BLACK) is children[2]
+
+    duplicate = gofish.Node(parent = root)          # A later child with the same move as children[5]
+    duplicate.set_value("B", "fa")
+    assert root.child_for_move(6, 1, gofish.BLACK) is children[5]
+
+    root.remove_child(children[5])
+    assert root.child_for_move(6, 1, gofish.BLACK) is duplicate
+    root.remove_child(children[0])
+    assert root.child_for_move(1, 1, gofish.BLACK) is None
+    assert root.child_for_move(12, 1, gofish.BLACK) is children[11]
+
+
+def test_child_index_sees_changed_moves():
+    root, children = many_children(12)
+    assert root.child_for_move(4, 1, gofish.BLACK) is children[3]
+
+    children[3].set_value("B", "ss")                # Already indexed
+    assert root.child_for_move(4, 1, gofish.BLACK) is None
+    assert root.child_for_move(19, 19, gofish.BLACK) is children[3]
+
+    late = gofish.Node(parent = root)               # Not yet indexed, so the index is kept
+    late.set_value("W", "aa")
+    index = root.child_index
+    late.set_value("W", "bb")
+    assert root.child_index is index
+    assert root.child_for_move(2, 2, gofish.WHITE) is late
+
+
+def test_board_cache_lru():
+    cache = gofish.BoardCache(max_size = 2)
+    nodes = [gofish.Node(parent = None) for n in range(4)]
+    boards = [gofish.Board(9) for n in range(4)]
+
+    cache.put(nodes[0], boards[0])
+    cache.put(nodes[1], boards[1])
+    assert cache.get(nodes[0]) is boards[0]        # So nodes[1] is now the least recently used
+    cache.put(nodes[2], boards[2])
+
+    assert cache.peek(nodes[1]) is None
+    assert cache.peek(nodes[0]) is boards[0] and cache.peek(nodes[2]) is boards[2]
+    assert cache.stats()["evictions"] == 1
+
+    del nodes[0]                                    # A dead node's board goes too
+    assert len(cache.entries) == 1
+
+
+def checkpoint_depths(line):
+    return [depth for depth, node in enumerate(line) if id(node) in gofish.board_cache.checkpoints]
+
+
+def test_checkpoints_are_at_real_depths():
+    gofish.board_cache.clear()
+    root = gofish.new_tree(19)
+    leaf = line_of_moves(root, [("BW"[n % 2], gofish.string_from_point(n % 19 + 1, n // 19 + 1)) for n in range(40)])
+    line = list(gofish.walk_mainline(root))
+    gofish.board_cache.clear()
+
+    line[20].board                  # Builds from the root, so a checkpoint at 16
+    leaf.board                      # Builds from depth 20, so checkpoints at 32 (not 36)
+    assert checkpoint_depths(line) == [16, 32]
+
+    gofish.board_cache.clear()
+    line[5].board = line[5].build_board()           # Set directly, so its depth isn't known yet
+    leaf.board
+    assert checkpoint_depths(line) == [16, 32]
+    assert gofish.board_cache.peek_entry(leaf)[1] == 40
+
+
+def ko_game():
+
+    # A ko at (3, 3) / (3, 4), with Black to play at the root. White takes; if both then pass,
+    # Black retaking recreates the root position, but with White to play.
+
+    root = gofish.new_tree(9)
+    for point in ["bc", "dc", "cb"]:
+        root.add_value("AW", point)
+    for point in ["bd", "dd", "ce", "cc"]:
+        root.add_value("AB", point)
+    return root.make_move(3, 4, gofish.WHITE)
+
+
+def test_superko():
+    take = ko_game()
+
+    with pytest.raises(gofish.IllegalMove):         # Simple ko
+        take.make_move(3, 3, gofish.BLACK)
+
+    node = take.make_pass(gofish.BLACK).make_pass(gofish.WHITE)
+
+    assert (3, 3) in node.legal_moves(gofish.BLACK)
+    assert (3, 3) not in node.legal_moves(gofish.BLACK, superko = "positional")
+    assert (3, 3) in node.legal_moves(gofish.BLACK, superko = "situational")
+
+    with pytest.raises(gofish.IllegalMove):
+        node.make_move(3, 3, gofish.BLACK, superko = "positional")
+
+    retake = node.make_move(3, 3, gofish.BLACK, superko = "situational")
+    assert retake.board.hash == take.parent.board.hash
+
+    node = retake.make_pass(gofish.WHITE).make_pass(gofish.BLACK)       # White taking again repeats take
+    with pytest.raises(gofish.IllegalMove):
+        node.make_move(3, 4, gofish.WHITE, superko = "situational")
+    assert (3, 4) not in node.legal_moves(gofish.WHITE, superko = "situational")
+
+
+def dropped_tree_refs(weak_parents):
+
+    # Build a tree (with boards, a history and a variation), drop it, and return weakrefs to its nodes.
+
+    root = gofish.new_tree(9, weak_parents = weak_parents)
+    leaf = line_of_moves(root, [("B", "cc"), ("W", "gg"), ("B", "cg")])
+    leaf.make_move(7, 3).position_history()
+    leaf.parent.make_move(5, 5)
+
+    assert leaf.parent.parent.parent is root
+    assert root.children[0].children[0].children[0] is leaf
+
+    refs = [weakref.ref(node) for node in [root, leaf, leaf.parent]]
+    del root, leaf
+    return refs
+
+
+def test_weak_parents_free_dropped_trees():
+    gc.disable()
+    try:
+        assert all(ref() is None for ref in dropped_tree_refs(weak_parents = True))
+        assert all(ref() is not None for ref in dropped_tree_refs(weak_parents = False))       # Cycles, left for gc
+    finally:
+        gc.enable()
+        gc.collect()
+
+    root = gofish.new_tree(9, weak_parents = True)
+    leaf = root.make_move(3, 3)
+    del root
+    with pytest.raises(ReferenceError):
+        leaf.parent
+
+
+def legal_by_trying(node, colour, superko, keep = False):
+
+    # The points where make_move() succeeds. Unless keep is set, the children it makes are
+    # removed again, so they don't count as existing moves (which are always allowed).
+
+    legal = set()
+    size = node.board.boardsize
+    for x in range(1, size + 1):
+        for y in range(1, size + 1):
+            children = list(node.children)
+            try:
+                child = node.make_move(x, y, colour, superko = superko)
+            except gofish.IllegalMove:
+                continue
+            legal.add((x, y))
+            if child not in children and not keep:
+                node.remove_child(child)
+    return legal
+
+
+def test_legal_moves_match_make_move():
+
+    # Random games on small boards, with passes and setup stones, preferring captures so that
+    # kos and repeated positions come up.
+
+    differences = 0
+
+    for seed in range(4):
+        rng = random.Random(seed)
+        size = [3, 4, 5, 4][seed]
+        node = gofish.new_tree(size)
+
+        for step in range(100):
+            colour = rng.choice([None, None, None, gofish.BLACK, gofish.WHITE])
+            if step % 10 == 9:
+                legal_by_trying(node, colour, None, keep = True)
+
+            found = dict()
+            for superko in [None, "positional", "situational"]:
+                legal = legal_by_trying(node, colour, superko)
+                assert node.legal_moves(colour, superko) == legal
+                width = node.board.width
+                assert node.legal_moves_mask(colour, superko) == sum(1 << (x * width + y) for x, y in legal)
+                found[superko] = legal
+            if found[None] != found["positional"] or found[None] != found["situational"]:
+                differences += 1
+
+            r = rng.random()
+            if r < 0.15 or not found[None]:
+                node = node.make_pass()
+            elif r < 0.18:
+                node = gofish.Node(parent = node)
+                node.set_value(rng.choice(["AB", "AW", "AE"]), gofish.string_from_point(rng.randint(1, size), rng.randint(1, size)))
+            else:
+                mover = colour or (gofish.WHITE if node.last_colour_played() == gofish.BLACK else gofish.BLACK)
+                moves = sorted(found[None])
+                captures = [move for move in moves if node.board.preview_move(mover, *move)[0] > 0]
+                node = node.make_move(*rng.choice(captures if captures and rng.random() < 0.8 else moves), colour)
+
+    assert differences > 0          # Superko did rule something out
+
+    node = gofish.new_tree(5).make_move(3, 3, gofish.BLACK)
+    node = gofish.Node(parent = node)
+    node.set_value("AE", "cc")                      # Playing there again recreates the parent's position, with no capture
+    assert legal_by_trying(node, gofish.BLACK, None) == node.legal_moves(gofish.BLACK)
+    assert (3, 3) not in node.legal_moves(gofish.BLACK)
+
+
+def test_nodes_and_boards_have_no_dict():          # __slots__ all the way down, since big trees have a great many nodes
+    objects = [gofish.Node(parent = None), gofish.parse_sgf_lazy("(;SZ[9];B[aa])"), gofish.new_store(9),
+               gofish.Board(19), gofish.BitBoard(19)]
+    for thing in objects:
+        assert not hasattr(thing, "__dict__"), type(thing).__name__
+        with pytest.raises(AttributeError):
+            thing.some_new_attribute = 1